@@ -0,0 +1,406 @@
+"""
+benchmarks.jobber_benchmarks
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Benchmarks of Jobber's scoring functions and API endpoints against a synthetic workload.
+
+Usage:
+
+    python benchmarks/jobber_benchmarks.py --output results.json
+    python benchmarks/jobber_benchmarks.py --baseline results.json --tolerance 0.15
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import string
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlencode
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobber', 'api')
+sys.path.insert(0, API_DIR)
+
+import yaml  # noqa: E402
+import jobber_api_utils as jau  # noqa: E402
+
+JOB_POSTING_ID = 'bench-posting'
+
+
+def generate_workload(questions=10, applications=1000, vocabulary=200, accept_rate=0.3, seed=42):
+    """
+    Generate a synthetic question set and job applications.
+
+    Acceptable answers and the answers of accepted applications are drawn from one
+    vocabulary. Rejected applications answer at least one question with words from a
+    disjoint vocabulary, so they fail whatever the fuzzy ratios.
+
+    :param int questions: number of questions
+    :param int applications: number of job applications
+    :param int vocabulary: number of distinct words answers are made of
+    :param float accept_rate: fraction of the job applications that should be accepted
+    :param int seed: random seed, the same arguments always generate the same workload
+    :return: tuple (list of questions, list of job applications)
+    """
+    rng = random.Random(seed)
+
+    def make_words(prefix, count):
+        return ['{}{}'.format(prefix, ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8))))
+                for _ in range(count)]
+
+    words = make_words('', vocabulary)
+    other_words = make_words('x', vocabulary)
+
+    question_set = list()
+    for number in range(questions):
+        answer = 'any' if number == 0 else ' '.join(rng.sample(words, rng.randint(1, 3)))
+        question_set.append({'id': 'q{}'.format(number),
+                             'question': 'Question {}?'.format(number),
+                             'answer': answer})
+
+    job_applications = list()
+    for number in range(applications):
+        accepted = rng.random() < accept_rate
+        failing_question = None if accepted else rng.randrange(1, questions) if questions > 1 else 0
+
+        applicant_responses = list()
+        for question_number, question in enumerate(question_set):
+            if question_number == failing_question:
+                answer = ' '.join(rng.sample(other_words, rng.randint(1, 4)))
+            else:
+                filler = rng.sample(words, rng.randint(0, 4))
+                answer = ' '.join(filler + [question['answer']])
+            applicant_responses.append({'id': question['id'], 'answer': answer})
+
+        job_applications.append({'id': 'a{}'.format(number),
+                                 'name': 'Applicant {}'.format(number),
+                                 'applicant_responses': applicant_responses})
+
+    return question_set, job_applications
+
+
+def measure(function, iterations, setup=None):
+    """
+    Time repeated calls of a function.
+
+    :param function: function taking the iteration number
+    :param int iterations: number of calls
+    :param setup: function taking the iteration number, called untimed before each call
+    :return: dict of timing statistics in milliseconds
+    """
+    timings = list()
+    for iteration in range(iterations):
+        if setup is not None:
+            setup(iteration)
+        started = time.perf_counter()
+        function(iteration)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    total = sum(timings)
+
+    return {
+        'iterations': iterations,
+        'mean_ms': total / iterations,
+        'p50_ms': timings[int(iterations * 0.5)],
+        'p95_ms': timings[min(iterations - 1, int(iterations * 0.95))],
+        'ops_per_sec': iterations / (total / 1000) if total else None
+    }
+
+
+def benchmark_scoring(question_set, job_applications, iterations):
+    """
+    Microbenchmark the scoring functions.
+
+    :return: dict of results by benchmark name
+    """
+    qualification_set = jau.QualificationSet(dict((q['id'], q['answer']) for q in question_set), version=1)
+    answer_pairs = [(response['answer'], qualification_set[response['id']])
+                    for job_application in job_applications
+                    for response in job_application['applicant_responses']]
+
+    def pick_application(iteration):
+        return job_applications[iteration % len(job_applications)]
+
+    def pick_pair(iteration):
+        return answer_pairs[iteration % len(answer_pairs)]
+
+    results = dict()
+
+    results['create_fuzzy_matches'] = measure(
+        lambda i: jau._create_fuzzy_matches(pick_pair(i)[0], pick_pair(i)[1].answer), iterations)
+    results['answer_in_response'] = measure(
+        lambda i: jau._answer_in_response(pick_pair(i)[0], pick_pair(i)[1].answer), iterations)
+    results['answer_in_response.compiled'] = measure(
+        lambda i: jau._answer_in_response(pick_pair(i)[0], pick_pair(i)[1]), iterations)
+
+    answers_by_question = dict()
+    for answer, rule in answer_pairs:
+        answers_by_question.setdefault(rule.id, (rule, list()))[1].append(answer)
+    batches = list(answers_by_question.values())
+
+    results['match_answers'] = measure(
+        lambda i: jau.match_answers(*batches[i % len(batches)]), max(1, iterations // 100))
+    results['match_answers']['answers_per_call'] = len(answer_pairs) // len(batches)
+
+    for mode in jau.SCORING_MODES:
+        results['score_job_application.{}'.format(mode)] = measure(
+            lambda i: jau.score_job_application(qualification_set, pick_application(i), mode), iterations)
+
+        cache = jau.VerdictCache()
+        results['score_job_application.{}.cached'.format(mode)] = measure(
+            lambda i: jau.score_job_application(qualification_set, pick_application(i), mode, cache), iterations)
+        results['score_job_application.{}.cached'.format(mode)]['cache'] = cache.stats()
+
+    return results
+
+
+class EndpointDriver(object):
+    """
+    Drives every operation of jobber_api.yaml through the connexion app's test client.
+    """
+
+    def __init__(self, client, spec, question_set, job_applications):
+        self.client = client
+        self.spec = spec
+        self.question_set = question_set
+        self.job_applications = job_applications
+        self.job_posting = {'title': 'Benchmark', 'question_ids': [question['id'] for question in question_set]}
+        self.base_path = spec.get('basePath', '')
+        self.created = 0
+
+    def send(self, method, url, body=None):
+        """
+        Send a request, JSON encoding the body.
+
+        :return: the test client response
+        """
+        if body is None:
+            return self.client.open(url, method=method)
+        return self.client.open(url, method=method, data=json.dumps(body), content_type='application/json')
+
+    def operations(self):
+        """
+        List the operations of the API specification.
+
+        :return: list of (operationId, method, path) tuples
+        """
+        operations = list()
+        for path, path_item in sorted(self.spec['paths'].items()):
+            for method, operation in sorted(path_item.items()):
+                if isinstance(operation, dict) and 'operationId' in operation:
+                    operations.append((operation['operationId'], method.upper(), path))
+        return operations
+
+    def request_for(self, operation_id, method, path, iteration):
+        """
+        Build the request an iteration of an operation sends.
+
+        :return: tuple (method, url, body, setup request), or None if the operation can't be
+                 driven automatically. The setup request, if any, is a (method, url, body) tuple
+                 sent untimed before the request, e.g. to create what a delete removes.
+        """
+        question = self.question_set[iteration % len(self.question_set)]
+        job_application = self.job_applications[iteration % len(self.job_applications)]
+        path_values = {
+            'question_id': question['id'],
+            'job_application_id': job_application['id'],
+            'job_posting_id': JOB_POSTING_ID,
+            'rescore_job_id': 1
+        }
+
+        if method == 'GET':
+            if any(name not in path_values for name in re.findall(r'{(\w+)}', path)):
+                return None
+            url = self.base_path + path.format(**path_values)
+            if operation_id == 'jobber.search_job_applications':
+                url += '?' + urlencode({'q': job_application['name']})
+            return method, url, None, None
+
+        # Writes use fresh ids so every iteration does the same amount of work
+        self.created += 1
+        new_id = 'bench{}x{}'.format(self.created, uuid.uuid4().hex[:8])
+
+        if operation_id == 'jobber.put_question':
+            url = self.base_path + path.format(question_id=new_id)
+            return method, url, dict(question, id=new_id), None
+        if operation_id == 'jobber.delete_question':
+            url = self.base_path + path.format(question_id=new_id)
+            return method, url, None, ('PUT', url, dict(question, id=new_id))
+        if operation_id == 'jobber.put_job_posting':
+            url = self.base_path + path.format(job_posting_id=new_id)
+            return method, url, self.job_posting, None
+        if operation_id == 'jobber.delete_job_posting':
+            url = self.base_path + path.format(job_posting_id=new_id)
+            return method, url, None, ('PUT', url, self.job_posting)
+        if operation_id == 'jobber.put_job_application':
+            url = self.base_path + path.format(job_application_id=new_id)
+            return method, url, dict(job_application, id=new_id), None
+        if operation_id == 'jobber.delete_job_application':
+            url = self.base_path + path.format(job_application_id=new_id)
+            return method, url, None, ('PUT', url, dict(job_application, id=new_id))
+        if operation_id == 'jobber.post_job_applications_batch':
+            body = [dict(application, id='{}-{}'.format(new_id, number))
+                    for number, application in enumerate(self.job_applications[:50])]
+            return method, self.base_path + path, body, None
+
+        return None
+
+    def run(self, iterations):
+        """
+        Benchmark every operation that can be driven.
+
+        :return: tuple (dict of results by operationId, list of operations that were skipped)
+        """
+        results = dict()
+        skipped = list()
+
+        for operation_id, method, path in self.operations():
+            if self.request_for(operation_id, method, path, 0) is None:
+                skipped.append(operation_id)
+                continue
+
+            statuses = dict()
+            requests = dict()
+
+            def setup(iteration):
+                requests[iteration] = self.request_for(operation_id, method, path, iteration)
+                setup_request = requests[iteration][3]
+                if setup_request is not None:
+                    self.send(*setup_request)
+
+            def call(iteration):
+                request_method, url, body, _ = requests.pop(iteration)
+                response = self.send(request_method, url, body)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            results[operation_id] = measure(call, iterations, setup)
+            results[operation_id]['statuses'] = statuses
+
+        return results, skipped
+
+
+def benchmark_endpoints(question_set, job_applications, iterations):
+    """
+    Benchmark the API endpoints in-process against a temporary SQLite database.
+
+    :return: tuple (dict of results by operationId, list of operations that were skipped)
+    """
+    import jobber
+
+    # Writes reuse the content of the workload's applications, which would otherwise be deduplicated
+    app = jobber.create_app({'DB_DIR': tempfile.mkdtemp(prefix='jobber-benchmark-'),
+                             'DB_FILE_NAME': 'jobber.db',
+                             'DEDUP_WINDOW_SECONDS': 0})
+
+    with open(os.path.join(API_DIR, 'jobber_api.yaml')) as spec_file:
+        spec = yaml.safe_load(spec_file)
+
+    driver = EndpointDriver(app.app.test_client(), spec, question_set, job_applications)
+    base_path = driver.base_path
+
+    for question in question_set:
+        driver.send('PUT', '{}/questions/{}'.format(base_path, question['id']), question)
+    driver.send('POST', '{}/job-applications:batch'.format(base_path), job_applications)
+    driver.send('PUT', '{}/job-postings/{}'.format(base_path, JOB_POSTING_ID), driver.job_posting)
+
+    # Changing an answer schedules the rescore job the rescore job endpoints read
+    changed_question = question_set[-1]
+    driver.send('PUT', '{}/questions/{}'.format(base_path, changed_question['id']),
+                dict(changed_question, answer=changed_question['answer'] + ' changed'))
+    driver.send('PUT', '{}/questions/{}'.format(base_path, changed_question['id']), changed_question)
+
+    return driver.run(iterations)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline.
+
+    :param dict results: the current results
+    :param dict baseline: results of an earlier run
+    :param float tolerance: allowed relative slowdown of the mean, e.g. 0.1 for 10%
+    :return: list of regressions
+    """
+    regressions = list()
+
+    for group in ('scoring', 'endpoints'):
+        for name, result in results.get(group, dict()).items():
+            previous = baseline.get(group, dict()).get(name)
+            if previous is None or not previous.get('mean_ms'):
+                continue
+
+            change = result['mean_ms'] / previous['mean_ms'] - 1
+            result['baseline_mean_ms'] = previous['mean_ms']
+            result['change'] = change
+
+            if change > tolerance:
+                regressions.append({'benchmark': '{}.{}'.format(group, name),
+                                    'baseline_mean_ms': previous['mean_ms'],
+                                    'mean_ms': result['mean_ms'],
+                                    'change': change})
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Jobber scoring and API endpoints.')
+    parser.add_argument('--questions', type=int, default=10, help='number of questions')
+    parser.add_argument('--applications', type=int, default=1000, help='number of job applications')
+    parser.add_argument('--vocabulary', type=int, default=200, help='distinct words in answers')
+    parser.add_argument('--accept-rate', type=float, default=0.3, help='fraction of accepted job applications')
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the workload')
+    parser.add_argument('--iterations', type=int, default=1000, help='iterations per scoring benchmark')
+    parser.add_argument('--endpoint-iterations', type=int, default=100, help='iterations per endpoint benchmark')
+    parser.add_argument('--skip-endpoints', action='store_true', help='only run the scoring benchmarks')
+    parser.add_argument('--output', help='write the results to this JSON file instead of stdout')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown before failing')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+
+    question_set, job_applications = generate_workload(questions=args.questions,
+                                                       applications=args.applications,
+                                                       vocabulary=args.vocabulary,
+                                                       accept_rate=args.accept_rate,
+                                                       seed=args.seed)
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'workload': vars(args)
+        },
+        'scoring': benchmark_scoring(question_set, job_applications, args.iterations)
+    }
+
+    if not args.skip_endpoints:
+        results['endpoints'], results['meta']['skipped_endpoints'] = \
+            benchmark_endpoints(question_set, job_applications, args.endpoint_iterations)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results['regressions'] = compare(results, json.load(baseline_file), args.tolerance)
+        exit_code = 1 if results['regressions'] else 0
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,40 +6,395 @@ Functions making up the Jobber API
 """
 
 import connexion
+import connexion.apis.abstract
+import csv
 import datetime
+import hashlib
+import io
+import flask
+import json
 import logging
-from os import getenv
+import os
+import sys
+import time
+import yaml
+from contextlib import contextmanager
+from email.utils import format_datetime, parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import cpu_count, getenv
 from collections import defaultdict
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from werkzeug.local import LocalProxy
 import jobber_orm as jorm
 import jobber_api_utils as jau
+import jobber_archiving as jarc
+import jobber_ingestion as jing
+import jobber_metrics as jmet
+import jobber_rescoring as jres
+import jobber_search as jsearch
+import jobber_server as jserv
 
-db_session = None
+if __name__ == '__main__':
+    # connexion imports the operations from the jobber module, make that this module rather than a second copy
+    sys.modules['jobber'] = sys.modules[__name__]
 
 nested_dict = lambda: defaultdict(nested_dict)
 
 
-def get_questions():
+class JobberState(object):
+    """
+    The database, compiled rules, caches, settings and background workers of one Jobber app.
+
+    create_app keeps it in the Flask app's extensions and the API functions look it up
+    through flask.current_app, so apps created in the same process, e.g. by tests, don't
+    share anything but the process-wide metrics.
+    """
+
+    def __init__(self, db_session, batch_workers=1, batch_chunk_size=500, export_chunk_size=1000,
+                 export_watermark_lag=30, scoring_mode=jau.FULL_SCORING, verdict_cache_size=10000,
+                 async_ingestion=False, dedup_window=600, background_workers=True):
+        """
+        :param db_session: the scoped database session
+        :param int batch_workers: processes scoring batch submissions
+        :param int batch_chunk_size: job applications scored and saved per transaction in a batch
+        :param int export_chunk_size: job applications read and written per export chunk
+        :param float export_watermark_lag: seconds the export watermark lags behind the request
+        :param str scoring_mode: the scoring mode, one of jau.SCORING_MODES
+        :param int verdict_cache_size: scored answers kept in the verdict cache, 0 disables it
+        :param bool async_ingestion: queue new job applications for the ingestion workers to score
+        :param int dedup_window: seconds within which resubmissions are answered with the first verdict
+        :param bool background_workers: False to never start the database workers, e.g. on an in-memory database
+        """
+        self.db_session = db_session
+        self.batch_workers = batch_workers
+        self.batch_chunk_size = batch_chunk_size
+        self.export_chunk_size = export_chunk_size
+        self.export_watermark_lag = export_watermark_lag
+        self.scoring_mode = scoring_mode
+        self.verdict_cache = jau.VerdictCache(maxsize=verdict_cache_size)
+        self.async_ingestion = async_ingestion
+        self.dedup_window = dedup_window
+        self.background_workers = background_workers
+
+        self.qualification_set = None
+        self.posting_rule_sets = dict()
+        self.posting_rules_version = 0
+        self.scoring_pool = None
+        self.search_index = None
+        self.ingestion_queue = None
+        self.rescorer = None
+        self.archiver = None
+        self.profiler = None
+        self.admission = None
+        self.operation_ids = dict()
+
+        # Metrics read from this app's state, rendered along with the process-wide ones
+        self.registry = jmet.Registry()
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_verdict_cache_size', 'Scored answers in the verdict cache.',
+            lambda: self.verdict_cache.stats()['size']))
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_verdict_cache_hits_total', 'Answers whose verdict was found in the verdict cache.',
+            lambda: self.verdict_cache.stats()['hits'], 'counter'))
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_verdict_cache_misses_total', 'Answers whose verdict had to be computed.',
+            lambda: self.verdict_cache.stats()['misses'], 'counter'))
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_verdict_cache_evictions_total', 'Verdicts evicted from the verdict cache.',
+            lambda: self.verdict_cache.stats()['evictions'], 'counter'))
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_admission_queue_depth', 'Requests waiting for their turn to be handled.',
+            lambda: self.admission.depths() if self.admission is not None else dict(), labelnames=('class',)))
+        self.registry.register(jmet.CallbackMetric(
+            'jobber_qualification_set_version', 'Version of the compiled question set.',
+            lambda: self.qualification_set.version if self.qualification_set is not None else 0))
+
+    def _sync_rule_caches(self):
+        """
+        Drop the compiled rules that another process made stale.
+
+        Every API worker process compiles its own rules. The version rows of the questions
+        and job_postings tables, bumped by every write, tell when another process changed them.
+        """
+        versions = dict(self.db_session.query(jorm.TableVersion.name, jorm.TableVersion.version)
+                        .filter(jorm.TableVersion.name.in_(('questions', 'job_postings'))))
+
+        if self.qualification_set is not None and self.qualification_set.version != versions.get('questions', 0):
+            logging.info("Questions changed in another process, recompiling the qualification set")
+            self.qualification_set = None
+
+        if self.posting_rules_version != versions.get('job_postings', 0):
+            self.posting_rule_sets.clear()
+            self.posting_rules_version = versions.get('job_postings', 0)
+
+    def advance_posting_rules(self, job_posting_id, version):
+        """
+        Drop the rule set of a job posting after it was changed in this process.
+
+        :param str job_posting_id: the id of the job posting
+        :param int version: the version of the job_postings table after the change
+        """
+        if self.posting_rules_version == version - 1:
+            self.posting_rule_sets.pop(job_posting_id, None)
+        else:
+            # Another process changed job postings in between
+            self.posting_rule_sets.clear()
+        self.posting_rules_version = version
+
+    def get_qualification_set(self):
+        """
+        Get the compiled qualification set, building it from the database on first use.
+
+        :return: the compiled acceptable answers of all questions
+        :rtype: jau.QualificationSet
+        """
+        self._sync_rule_caches()
+
+        if self.qualification_set is None:
+            logging.info("Compiling the qualification set")
+            version = jorm.get_table_version(self.db_session, 'questions')
+            questions = dict(self.db_session.query(jorm.Question.id, jorm.Question.answer))
+            self.qualification_set = jau.QualificationSet(questions, version=version)
+
+        return self.qualification_set
+
+    def get_rule_set(self, job_posting_id=None):
+        """
+        Get the compiled qualification set that applications to a job posting are scored against.
+
+        The rule sets of job postings are kept in an index by posting id. Each is built on
+        first use from the qualification set, sharing its compiled rules, and rebuilt once
+        the questions change.
+
+        :param str job_posting_id: id of the job posting, None for the set of all questions
+        :return: the qualification set, or None if the job posting doesn't exist
+        :rtype: jau.QualificationSet
+        """
+        application_questions = self.get_qualification_set()
+        if job_posting_id is None:
+            return application_questions
+
+        rule_set = self.posting_rule_sets.get(job_posting_id)
+
+        if rule_set is None or rule_set.version != application_questions.version:
+            job_posting = self.db_session.query(jorm.JobPosting)\
+                .filter(jorm.JobPosting.id == job_posting_id).one_or_none()
+            if job_posting is None:
+                self.posting_rule_sets.pop(job_posting_id, None)
+                return None
+
+            rule_set = application_questions.subset(job_posting.question_ids)
+            self.posting_rule_sets[job_posting_id] = rule_set
+
+        return rule_set
+
+    def get_rule_sets(self, job_applications):
+        """
+        Get the rule sets of the job postings some job applications name.
+
+        :param list job_applications: the job applications
+        :return: job posting ids and their qualification sets, leaving out postings that don't exist
+        :rtype: dict
+        """
+        job_posting_ids = set(job_application.get('job_posting_id') for job_application in job_applications
+                              if isinstance(job_application, dict) and job_application.get('job_posting_id') is not None)
+        rule_sets = dict((job_posting_id, self.get_rule_set(job_posting_id)) for job_posting_id in job_posting_ids)
+        return dict((job_posting_id, rule_set) for job_posting_id, rule_set in rule_sets.items() if rule_set is not None)
+
+    def preload_rule_sets(self):
+        """
+        Compile the qualification set and the rule sets of all job postings ahead of the first request.
+        """
+        application_questions = self.get_qualification_set()
+
+        question_ids = defaultdict(list)
+        for job_posting_id, question_id in self.db_session.query(jorm.JobPostingQuestion.job_posting_id,
+                                                                 jorm.JobPostingQuestion.question_id)\
+                .order_by(jorm.JobPostingQuestion.job_posting_id, jorm.JobPostingQuestion.position):
+            question_ids[job_posting_id].append(question_id)
+
+        for (job_posting_id,) in self.db_session.query(jorm.JobPosting.id):
+            self.posting_rule_sets[job_posting_id] = application_questions.subset(question_ids.get(job_posting_id, []))
+
+        self.db_session.remove()
+        logging.info("Compiled {} questions and {} job postings".format(len(application_questions),
+                                                                        len(self.posting_rule_sets)))
+
+    def score_queued_applications(self, job_applications):
+        """
+        Score a batch of job applications taken from the ingestion queue.
+
+        :param list job_applications: the job applications to score
+        :return: list of (scored job application, error message) tuples
+        """
+        return jau.score_job_applications(self.get_qualification_set(), job_applications, mode=self.scoring_mode,
+                                          rule_sets=self.get_rule_sets(job_applications), cache=self.verdict_cache)
+
+    def start_scoring_pool(self):
+        """
+        Start the processes that score batches of job applications, and import the scoring libraries in them.
+
+        Called before this process starts any thread: a process forked while another thread holds a lock,
+        such as the logging module's, can hang on it.
+        """
+        if self.batch_workers > 1 and self.scoring_pool is None:
+            self.scoring_pool = ProcessPoolExecutor(max_workers=self.batch_workers)
+            for future in [self.scoring_pool.submit(jau.load_scoring_libraries) for _ in range(self.batch_workers)]:
+                future.result()
+
+    def start_background_threads(self):
+        """
+        Start the scoring processes and the background threads, also those of a forked API worker.
+        """
+        self.start_scoring_pool()
+        if self.profiler is not None:
+            self.profiler.start()
+        if not self.background_workers:
+            return
+        if self.async_ingestion:
+            self.ingestion_queue.start()
+        self.rescorer.start()
+        self.archiver.start()
+
+    def stop_background_threads(self):
+        """
+        Stop the background threads and the scoring processes, and close the database connections,
+        e.g. before forking API workers.
+        """
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.async_ingestion:
+            self.ingestion_queue.stop()
+        self.rescorer.stop()
+        self.archiver.stop()
+
+        if self.scoring_pool is not None:
+            self.scoring_pool.shutdown()
+            self.scoring_pool = None
+        # Connections can't be shared with the forked processes
+        self.db_session.remove()
+        self.db_session.get_bind().dispose()
+
+    def close(self):
+        """
+        Stop the background threads and the scoring processes, and close the database connections.
+        """
+        self.stop_background_threads()
+
+
+def get_state():
+    """
+    Get the state of the app handling the current request.
+
+    :return: the state create_app keeps in the Flask app's extensions
+    :rtype: JobberState
+    """
+    return flask.current_app.extensions['jobber']
+
+
+# The database session of the app handling the current request
+db_session = LocalProxy(lambda: get_state().db_session)
+
+
+def _table_validators(*table_names):
+    """
+    Create the ETag and Last-Modified headers of a resource backed by one or more tables.
+
+    :param str table_names: names of the tables behind the resource
+    :return: the validator headers
+    :rtype: dict
+    """
+    table_versions = dict((table_version.name, table_version) for table_version in
+                          db_session.query(jorm.TableVersion).filter(jorm.TableVersion.name.in_(table_names)))
+
+    etags = list()
+    last_modified = None
+
+    for table_name in table_names:
+        table_version = table_versions.get(table_name)
+        etags.append('{}-{}'.format(table_name, table_version.version if table_version is not None else 0))
+        if table_version is not None and table_version.updated_at is not None:
+            last_modified = max(last_modified or table_version.updated_at, table_version.updated_at)
+
+    headers = {'ETag': '"{}"'.format(';'.join(etags))}
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+        headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+
+    return headers
+
+
+def _not_modified(validators):
+    """
+    Determine if the client's cached copy of a resource is still current.
+
+    :param dict validators: the resource's ETag and Last-Modified headers
+    :return: True if the request's If-None-Match or If-Modified-Since header matches
+    :rtype: bool
+    """
+    if_none_match = connexion.request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or \
+            validators['ETag'] in [etag.strip() for etag in if_none_match.split(',')]
+
+    if_modified_since = connexion.request.headers.get('If-Modified-Since')
+    if if_modified_since is not None and 'Last-Modified' in validators:
+        try:
+            return parsedate_to_datetime(validators['Last-Modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def _json_response(body, status, headers=None):
+    """
+    Encode a response body with the fast JSON encoder, bypassing connexion's serialization.
+
+    :param dict body: the response body, e.g. from jau.create_return_object
+    :param int status: the HTTP status
+    :param dict headers: additional headers
+    :return: the encoded response
+    :rtype: flask.Response
+    """
+    with jmet.stage_duration.time('serialize'):
+        return flask.Response(jau.dumps_json(body), status=status, headers=headers, mimetype='application/json')
+
+
+def get_questions(job_posting_id=None):
     """
     Get a list of questions.
 
+    :param str job_posting_id: only include the questions of this job posting, in its order
     :return: all questions in the database
     :rtype: dict
     """
     logging.info("get_questions endpoint called")
 
-    db_response = db_session.query(jorm.Question)
-
-    if db_response is None:
-        response_info = jau.create_return_object()
+    # Read the version before the data, so the ETag is never newer than the response
+    if job_posting_id is None:
+        validators = _table_validators('questions')
     else:
-        response_data = nested_dict()
-        response_data['questions'] = list()
-        for question in db_response:
-            response_data['questions'].append(question.dump())
+        validators = _table_validators('questions', 'job_postings')
+    if _not_modified(validators):
+        return connexion.NoContent, 304, validators
 
-        response_info = jau.create_return_object(data=response_data)
+    # Project the columns straight into dicts, without building Question objects
+    columns = jorm.Question.dump_columns
+    db_response = db_session.query(*[getattr(jorm.Question, column) for column in columns])
 
-    return response_info, 200
+    if job_posting_id is not None:
+        db_response = db_response.join(jorm.JobPostingQuestion,
+                                       jorm.JobPostingQuestion.question_id == jorm.Question.id)\
+            .filter(jorm.JobPostingQuestion.job_posting_id == job_posting_id)\
+            .order_by(jorm.JobPostingQuestion.position)
+
+    response_data = {'questions': [dict(zip(columns, row)) for row in db_response]}
+    response_info = jau.create_return_object(data=response_data)
+
+    return _json_response(response_info, 200, validators)
 
 
 def get_question(question_id):
@@ -52,16 +407,20 @@ def get_question(question_id):
     """
     logging.info("get_question endpoint called")
 
+    validators = _table_validators('questions')
+
     db_response = db_session.query(jorm.Question).filter(jorm.Question.id == question_id).one_or_none()
 
     if db_response is None:
         error_response = jau.create_return_object(error_status=True,
                                                   error_message="Not Found")
         return error_response, 404
+    elif _not_modified(validators):
+        return connexion.NoContent, 304, validators
     else:
         response_data = db_response.dump()
         response_info = jau.create_return_object(data = response_data)
-        return response_info, 200
+        return response_info, 200, validators
 
 
 def put_question(question_id, question):
@@ -74,12 +433,15 @@ def put_question(question_id, question):
     :rtype: dict
     """
     logging.info("put_question endpoint called")
+    state = get_state()
 
     db_response = db_session.query(jorm.Question).filter(jorm.Question.id == question_id).one_or_none()
     question['id'] = question_id
+    answer_changed = False
 
     if db_response is not None:
         logging.info("Updating question {}".format(question_id))
+        answer_changed = question.get('answer') is not None and question['answer'] != db_response.answer
         db_response.update(**question)
         response = jau.create_return_object()
     else:
@@ -89,8 +451,29 @@ def put_question(question_id, question):
         db_session.add(jorm.Question(**question))
         response = jau.create_return_object()
 
+    version = jorm.bump_table_version(db_session, 'questions')
+
+    if answer_changed:
+        # Stored job applications that answered the question are re-scored in the background
+        rescore_job = state.rescorer.schedule(question_id, version)
+        response = jau.create_return_object(data={'rescore_job_id': rescore_job.id})
+
     db_session.commit()
 
+    qualification_set = state.qualification_set
+    if qualification_set is not None and qualification_set.version != version - 1:
+        # Another process changed the questions in between, recompile them on next use
+        qualification_set = state.qualification_set = None
+
+    if qualification_set is not None:
+        answer = question['answer'] if question.get('answer') is not None else db_response.answer
+        if question_id in qualification_set and qualification_set[question_id].answer != answer:
+            state.verdict_cache.invalidate(question_id)
+        qualification_set.add(question_id, answer, version)
+
+    if answer_changed:
+        state.rescorer.notify()
+
     return response, (200 if question is not None else 201)
 
 
@@ -103,13 +486,29 @@ def delete_question(question_id):
     :rtype: dict
     """
     logging.info("delete_question endpoint called")
+    state = get_state()
 
     question = db_session.query(jorm.Question).filter(jorm.Question.id == question_id).one_or_none()
 
     if question is not None:
         logging.info('Deleting question {}', question_id)
         db_session.query(jorm.Question).filter(jorm.Question.id == question_id).delete()
+        version = jorm.bump_table_version(db_session, 'questions')
+        removed = db_session.query(jorm.JobPostingQuestion)\
+            .filter(jorm.JobPostingQuestion.question_id == question_id).delete(synchronize_session=False)
+        if removed:
+            jorm.bump_table_version(db_session, 'job_postings')
         db_session.commit()
+
+        qualification_set = state.qualification_set
+        if qualification_set is not None and qualification_set.version != version - 1:
+            # Another process changed the questions in between, recompile them on next use
+            qualification_set = state.qualification_set = None
+
+        if qualification_set is not None:
+            qualification_set.remove(question_id, version)
+        state.verdict_cache.invalidate(question_id)
+
         response = jau.create_return_object()
         return response, 200
     else:
@@ -118,112 +517,1018 @@ def delete_question(question_id):
         return response, 404
 
 
-def get_job_applications():
+def get_question_statistics(question_id):
     """
-    Get all of the accepted job applications
+    Get how applicants answered a question.
 
-    :return: approved job applications
+    :param str question_id: the id of the question
+    :return: the number of passing and failing answers and the distribution of answers
     :rtype: dict
     """
-    logging.info("get_job_applications endpoint called")
+    logging.info("get_question_statistics endpoint called")
+
+    question = db_session.query(jorm.Question).filter(jorm.Question.id == question_id).one_or_none()
+
+    if question is None:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_message="Not Found")
+        return error_response, 404
+
+    # Both queries are answered from the (question_id, passed) and (question_id, answer) indexes
+    verdicts = dict(db_session.query(jorm.ApplicantResponse.passed, func.count())
+                    .filter(jorm.ApplicantResponse.question_id == question_id)
+                    .group_by(jorm.ApplicantResponse.passed))
+
+    answers = db_session.query(jorm.ApplicantResponse.answer, func.count().label('count'))\
+        .filter(jorm.ApplicantResponse.question_id == question_id)\
+        .group_by(jorm.ApplicantResponse.answer)\
+        .order_by(func.count().desc())
+
+    response_data = nested_dict()
+    response_data['id'] = question_id
+    response_data['passed'] = verdicts.get(True, 0)
+    response_data['failed'] = verdicts.get(False, 0)
+    response_data['unscored'] = verdicts.get(None, 0)
+    response_data['answers'] = [{'answer': answer, 'count': count} for answer, count in answers]
+
+    return jau.create_return_object(data=response_data), 200
+
+
+def get_job_postings():
+    """
+    Get a list of job postings.
+
+    :return: all job postings and the ids of their questions
+    :rtype: dict
+    """
+    logging.info("get_job_postings endpoint called")
+
+    validators = _table_validators('job_postings')
+    if _not_modified(validators):
+        return connexion.NoContent, 304, validators
+
+    # Project the columns straight into dicts, without building JobPosting objects
+    columns = jorm.JobPosting.dump_columns
+    job_postings = [dict(zip(columns, row))
+                    for row in db_session.query(*[getattr(jorm.JobPosting, column) for column in columns])
+                    .order_by(jorm.JobPosting.id)]
+
+    question_ids = defaultdict(list)
+    for job_posting_id, question_id in db_session.query(jorm.JobPostingQuestion.job_posting_id,
+                                                        jorm.JobPostingQuestion.question_id)\
+            .order_by(jorm.JobPostingQuestion.job_posting_id, jorm.JobPostingQuestion.position):
+        question_ids[job_posting_id].append(question_id)
+
+    for job_posting in job_postings:
+        job_posting['question_ids'] = question_ids.get(job_posting['id'], [])
+
+    response_info = jau.create_return_object(data={'job_postings': job_postings})
+
+    return _json_response(response_info, 200, validators)
+
+
+def get_job_posting(job_posting_id):
+    """
+    Get a single job posting.
+
+    :param str job_posting_id: the id of the job posting
+    :return: the job posting and the ids of its questions
+    :rtype: dict
+    """
+    logging.info("get_job_posting endpoint called")
+
+    validators = _table_validators('job_postings')
+
+    db_response = db_session.query(jorm.JobPosting).filter(jorm.JobPosting.id == job_posting_id).one_or_none()
+
+    if db_response is None:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_message="Not Found")
+        return error_response, 404
+    elif _not_modified(validators):
+        return connexion.NoContent, 304, validators
+    else:
+        response_info = jau.create_return_object(data=db_response.dump())
+        return response_info, 200, validators
+
+
+def put_job_posting(job_posting_id, job_posting):
+    """
+    Create or update a job posting.
+
+    :param str job_posting_id: the id of the job posting
+    :param dict job_posting: the job posting, with the ids of the questions its applicants answer
+    :return: result of the job posting submission
+    :rtype: dict
+    """
+    logging.info("put_job_posting endpoint called")
+
+    job_posting['id'] = job_posting_id
+    question_ids = job_posting.get('question_ids')
+
+    if question_ids is not None:
+        if len(set(question_ids)) != len(question_ids):
+            error_response = jau.create_return_object(error_status=True,
+                                                      error_cause="Duplicate question ids",
+                                                      error_message="Bad Request")
+            return error_response, 400
+
+        existing_ids = set(row.id for row in
+                           db_session.query(jorm.Question.id).filter(jorm.Question.id.in_(question_ids)))
+        unknown_ids = [question_id for question_id in question_ids if question_id not in existing_ids]
+        if unknown_ids:
+            error_response = jau.create_return_object(error_status=True,
+                                                      error_cause="Unknown questions {}".format(', '.join(unknown_ids)),
+                                                      error_message="Bad Request")
+            return error_response, 400
+
+    db_response = db_session.query(jorm.JobPosting).filter(jorm.JobPosting.id == job_posting_id).one_or_none()
+
+    if db_response is not None:
+        logging.info("Updating job posting {}".format(job_posting_id))
+        job_posting['updated_at'] = datetime.datetime.utcnow()
+        db_response.update(**job_posting)
+    else:
+        logging.info("Creating job posting {}".format(job_posting_id))
+        job_posting['created_at'] = datetime.datetime.utcnow()
+        job_posting['updated_at'] = datetime.datetime.utcnow()
+        db_session.add(jorm.JobPosting(**job_posting))
+
+    version = jorm.bump_table_version(db_session, 'job_postings')
+    db_session.commit()
+    get_state().advance_posting_rules(job_posting_id, version)
+
+    return jau.create_return_object(), 200
 
-    db_response = db_session.query(jorm.JobApplication).filter(jorm.JobApplication.accepted == 1)
+
+def delete_job_posting(job_posting_id):
+    """
+    Delete a job posting. Job applications submitted for it are kept.
+
+    :param str job_posting_id: the id of the job posting
+    :return: success or failure message
+    :rtype: dict
+    """
+    logging.info("delete_job_posting endpoint called")
+
+    db_response = db_session.query(jorm.JobPosting).filter(jorm.JobPosting.id == job_posting_id).one_or_none()
 
     if db_response is None:
-        response_info = jau.create_return_object()
+        response = jau.create_return_object(error_status=True,
+                                            error_message="Not Found")
+        return response, 404
+
+    logging.info("Deleting job posting {}".format(job_posting_id))
+    db_session.delete(db_response)
+    version = jorm.bump_table_version(db_session, 'job_postings')
+    db_session.commit()
+    get_state().advance_posting_rules(job_posting_id, version)
+
+    return jau.create_return_object(), 200
+
+
+def get_rescore_jobs(limit=20):
+    """
+    Get the most recent re-scoring jobs.
+
+    :param int limit: maximum number of jobs to return
+    :return: re-scoring jobs, newest first
+    :rtype: dict
+    """
+    logging.info("get_rescore_jobs endpoint called")
+
+    rescore_jobs = db_session.query(jorm.RescoreJob).order_by(jorm.RescoreJob.id.desc()).limit(limit)
+
+    response_data = nested_dict()
+    response_data['rescore_jobs'] = [_dump_rescore_job(rescore_job) for rescore_job in rescore_jobs]
+
+    return jau.create_return_object(data=response_data), 200
+
+
+def get_rescore_job(rescore_job_id):
+    """
+    Get the progress of a re-scoring job.
+
+    :param int rescore_job_id: ID of the re-scoring job
+    :return: the re-scoring job
+    :rtype: dict
+    """
+    logging.info("get_rescore_job endpoint called")
+
+    rescore_job = db_session.query(jorm.RescoreJob).filter(jorm.RescoreJob.id == rescore_job_id).one_or_none()
+
+    if rescore_job is None:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_message="Not Found")
+        return error_response, 404
+
+    return jau.create_return_object(data=_dump_rescore_job(rescore_job)), 200
+
+
+def _dump_rescore_job(rescore_job):
+    response_data = rescore_job.dump()
+    del response_data['worker']
+    del response_data['claimed_at']
+    del response_data['cursor']
+
+    if rescore_job.status == jorm.RescoreJob.DONE:
+        response_data['progress'] = 1.0
+    elif rescore_job.total:
+        response_data['progress'] = min(1.0, float(rescore_job.processed) / rescore_job.total)
     else:
-        response_data = nested_dict()
-        response_data['job_applications'] = list()
+        response_data['progress'] = 0.0
+
+    return response_data
+
+
+def _add_applicant_responses(session, job_applications):
+    """
+    Add the dumped applicant responses to job applications, fetching them in one query.
+
+    :param session: the database session
+    :param list job_applications: dicts of job application columns, including the id
+    """
+    responses = dict((job_application['id'], list()) for job_application in job_applications)
+
+    if responses:
+        response_columns = [getattr(jorm.ApplicantResponse, column) for column in jorm.ApplicantResponse.dump_columns]
+        for row in session.query(jorm.ApplicantResponse.job_application_id, *response_columns)\
+                .filter(jorm.ApplicantResponse.job_application_id.in_(list(responses)))\
+                .order_by(jorm.ApplicantResponse.job_application_id, jorm.ApplicantResponse.position):
+            responses[row[0]].append(jorm.ApplicantResponse.dump_row(*row[1:]))
+
+    for job_application in job_applications:
+        job_application['applicant_responses'] = responses[job_application['id']]
+
+
+def get_job_applications(limit=100, cursor=None, created_after=None, created_before=None, view='full',
+                         job_posting_id=None):
+    """
+    Get a page of the accepted job applications, newest first
+
+    :param int limit: maximum number of job applications to return
+    :param str cursor: the next_cursor of the previous page
+    :param str created_after: only include job applications created at or after this time
+    :param str created_before: only include job applications created before this time
+    :param str view: full to include the applicant responses, summary to leave them out
+    :param str job_posting_id: only include job applications for this job posting
+    :return: approved job applications and the cursor of the next page
+    :rtype: dict
+    """
+    logging.info("get_job_applications endpoint called")
+
+    try:
+        position = jau.decode_cursor(cursor) if cursor else None
+        created_after = jau.parse_datetime(created_after) if created_after else None
+        created_before = jau.parse_datetime(created_before) if created_before else None
+    except ValueError as e:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause=str(e),
+                                                  error_message="Bad Request")
+        return error_response, 400
+
+    # Read the version before the data, so the ETag is never newer than the response
+    validators = _table_validators('job_applications')
+    if _not_modified(validators):
+        return connexion.NoContent, 304, validators
+
+    # Project the columns straight into dicts, without building JobApplication objects
+    columns = jorm.JobApplication.summary_columns
+    db_response = db_session.query(*[getattr(jorm.JobApplication, column) for column in columns])
+
+    # Walks the (accepted, created_at, id) index, or (job_posting_id, accepted, created_at, id) for a posting
+    db_response = db_response.filter(jorm.JobApplication.accepted == True)  # noqa: E712
+    if job_posting_id is not None:
+        db_response = db_response.filter(jorm.JobApplication.job_posting_id == job_posting_id)
+
+    if created_after is not None:
+        db_response = db_response.filter(jorm.JobApplication.created_at >= created_after)
+    if created_before is not None:
+        db_response = db_response.filter(jorm.JobApplication.created_at < created_before)
+    if position is not None:
+        db_response = db_response.filter(or_(jorm.JobApplication.created_at < position[0],
+                                             and_(jorm.JobApplication.created_at == position[0],
+                                                  jorm.JobApplication.id < position[1])))
+
+    db_response = db_response.order_by(jorm.JobApplication.created_at.desc(),
+                                       jorm.JobApplication.id.desc()).limit(limit + 1)
+
+    with jmet.stage_duration.time('orm.load'):
+        job_applications = [dict(zip(columns, row)) for row in db_response]
+        page = job_applications[:limit]
+
+        if view != 'summary':
+            _add_applicant_responses(db_session, page)
+
+    response_data = {'job_applications': page, 'next_cursor': None}
+
+    if len(job_applications) > limit:
+        last_application = job_applications[limit - 1]
+        response_data['next_cursor'] = jau.encode_cursor(last_application['created_at'], last_application['id'])
+
+    response_info = jau.create_return_object(data=response_data)
+
+    return _json_response(response_info, 200, validators)
+
+
+def search_job_applications(q, limit=20, offset=0, job_posting_id=None):
+    """
+    Search the accepted job applications by name and answers, best match first
+
+    :param str q: words to search for
+    :param int limit: maximum number of job applications to return
+    :param int offset: number of better matches to skip
+    :param str job_posting_id: only search the job applications for this job posting
+    :return: matching job applications and the offset of the next page
+    :rtype: dict
+    """
+    logging.info("search_job_applications endpoint called")
+    search_index = get_state().search_index
+
+    if not search_index.available:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause="Full-text search needs SQLite with FTS5",
+                                                  error_message="Not Implemented")
+        return error_response, 501
+
+    if not jsearch.match_expression(q):
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause="q has no words to search for",
+                                                  error_message="Bad Request")
+        return error_response, 400
 
-        for job_application in db_response:
-            response_data['job_applications'].append(job_application.dump())
+    with jmet.stage_duration.time('search'):
+        job_applications = search_index.search(q, limit=limit + 1, offset=offset, job_posting_id=job_posting_id)
 
-        response_info = jau.create_return_object(data=response_data)
+    response_data = {'job_applications': job_applications[:limit], 'next_offset': None}
+    if len(job_applications) > limit:
+        response_data['next_offset'] = offset + limit
 
-    return response_info, 200
+    response_info = jau.create_return_object(data=response_data)
 
+    return _json_response(response_info, 200)
 
-def get_job_application(job_application_id):
+
+def export_job_applications(format='ndjson', include_rejected=False, updated_since=None, job_posting_id=None):
+    """
+    Stream job applications as NDJSON or CSV, oldest update first.
+
+    :param str format: ndjson for one JSON job application per line, csv for one row per job application
+    :param bool include_rejected: also export rejected job applications
+    :param str updated_since: only export job applications updated after this time
+    :param str job_posting_id: only export job applications for this job posting
+    :return: the streamed job applications, and the watermark to pass as updated_since next time
+    :rtype: flask.Response
+    """
+    logging.info("export_job_applications endpoint called")
+    state = get_state()
+
+    try:
+        updated_since = jau.parse_datetime(updated_since) if updated_since else None
+    except ValueError as e:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause=str(e),
+                                                  error_message="Bad Request")
+        return error_response, 400
+
+    # Rows updated after the watermark are left to the next export. Rows are stamped before their transaction
+    # commits, which may first wait for the write lock, so a row stamped just before now may not be visible yet;
+    # the watermark lags behind now by longer than a write transaction takes, so no such row is skipped
+    watermark = datetime.datetime.utcnow() - datetime.timedelta(seconds=state.export_watermark_lag)
+
+    headers = {
+        'X-Export-Watermark': jau.format_datetime(watermark),
+        'Content-Disposition': 'attachment; filename=job-applications.{}'.format(format)
+    }
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    chunks = _export_chunks(state.db_session.session_factory, state.export_chunk_size,
+                            format, include_rejected, updated_since, job_posting_id, watermark)
+
+    return flask.Response(chunks, mimetype=mimetype, headers=headers)
+
+
+def _export_chunks(session_factory, chunk_size, format, include_rejected, updated_since, job_posting_id, watermark):
+    """
+    Generate an export chunk by chunk, reading the job applications through a server-side cursor.
+
+    The chunks are generated after the request has finished, outside of the app context,
+    and other requests can be served in the same thread in between, so the export reads
+    through its own session.
+
+    :param session_factory: creates the session the export reads through
+    :param int chunk_size: job applications per chunk
+    :return: generator of encoded chunks
+    """
+    session = session_factory()
+    columns = jorm.JobApplication.summary_columns
+
+    try:
+        # Walks the (updated_at, id) index
+        query = session.query(*[getattr(jorm.JobApplication, column) for column in columns])\
+            .filter(jorm.JobApplication.updated_at <= watermark)
+        if not include_rejected:
+            query = query.filter(jorm.JobApplication.accepted == True)  # noqa: E712
+        if updated_since is not None:
+            query = query.filter(jorm.JobApplication.updated_at > updated_since)
+        if job_posting_id is not None:
+            query = query.filter(jorm.JobApplication.job_posting_id == job_posting_id)
+        query = query.order_by(jorm.JobApplication.updated_at, jorm.JobApplication.id)\
+            .execution_options(stream_results=True).yield_per(chunk_size)
+
+        if format == 'csv':
+            output = io.StringIO()
+            csv.writer(output).writerow(columns + ('applicant_responses',))
+            yield output.getvalue().encode('utf-8')
+
+        chunk = list()
+        for row in query:
+            chunk.append(dict(zip(columns, row)))
+            if len(chunk) == chunk_size:
+                yield _encode_export_chunk(session, chunk, format)
+                chunk = list()
+
+        if chunk:
+            yield _encode_export_chunk(session, chunk, format)
+    finally:
+        session.close()
+
+
+def _encode_export_chunk(session, job_applications, format):
+    """
+    Encode a chunk of exported job applications, along with their applicant responses.
+
+    :param session: the database session
+    :param list job_applications: dicts of job application columns
+    :param str format: ndjson or csv
+    :return: bytes the encoded chunk
+    """
+    _add_applicant_responses(session, job_applications)
+
+    if format != 'csv':
+        return b''.join(jau.dumps_json(job_application) + b'\n' for job_application in job_applications)
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for job_application in job_applications:
+        # Datetimes and booleans are written as they are in JSON
+        row = [jau.dumps_json(value).decode('utf-8').strip('"') if isinstance(value, (bool, datetime.datetime))
+               else value for value in (job_application[column] for column in jorm.JobApplication.summary_columns)]
+        row.append(jau.dumps_json(job_application['applicant_responses']).decode('utf-8'))
+        writer.writerow(row)
+    return output.getvalue().encode('utf-8')
+
+
+def get_job_application(job_application_id, explain=False):
     """
     Get a single job application
 
     :param int job_application_id: ID of the job application
+    :param bool explain: include the full fuzzy ratio breakdown of every answer
     :return: job application information
     :rtype: dict
     """
     logging.info("get_job_application endpoint called")
+    state = get_state()
 
     db_response = db_session.query(jorm.JobApplication).filter(jorm.JobApplication.id == job_application_id).one_or_none()
 
-    if db_response is None:
+    if db_response is not None:
+        response_data = db_response.dump()
+    else:
+        response_data = state.archiver.get(job_application_id)
+
+    if response_data is None:
         error_response = jau.create_return_object(error_status=True,
                                                   error_message="Not Found")
         return error_response, 404
     else:
         job_application = nested_dict()
 
-        response_data = db_response.dump()
-
         job_application['name'] = response_data['name']
         job_application['id'] = response_data['id']
         job_application['created_at'] = response_data['created_at']
         job_application['updated_at'] = response_data['updated_at']
+        job_application['archived'] = db_response is None
         job_application['applicant_responses'] = list()
 
-        for ar in response_data['applicant_responses']:
-            q_db_response = db_session.query(jorm.Question).filter(jorm.Question.id == ar['id']).one_or_none()
-            q_response_data = q_db_response.dump()
+        if explain:
+            response_data = jau.explain_job_application(state.get_qualification_set(), response_data)
+
+        # Look up the text of every answered question in a single query
+        question_ids = set(ar['id'] for ar in response_data['applicant_responses'])
+        question_texts = dict()
+        if question_ids:
+            question_texts = dict(db_session.query(jorm.Question.id, jorm.Question.question)
+                                  .filter(jorm.Question.id.in_(question_ids)))
 
+        for ar in response_data['applicant_responses']:
             q_response = nested_dict()
-            q_response['question'] = q_response_data['question']
+            q_response['id'] = ar['id']
+            # Questions deleted since the application was made have no text
+            q_response['question'] = question_texts.get(ar['id'])
+            q_response['question_deleted'] = ar['id'] not in question_texts
             q_response['answer'] = ar['answer']
 
+            if explain:
+                q_response['fuzzy_ratios'] = ar.get('fuzzy_ratios')
+                q_response['answer_in_response'] = ar.get('answer_in_response')
+
             job_application['applicant_responses'].append(q_response)
 
         response_info = jau.create_return_object(data=job_application)
         return response_info, 200
 
 
+def _get_verdict(job_application_id):
+    """
+    Look up whether a scored job application, including an archived one, was accepted.
+
+    :param str job_application_id: the id of the job application
+    :return: a tuple of the accepted flag, or None if no scored job application has the id
+    :rtype: tuple
+    """
+    accepted = db_session.query(jorm.JobApplication.accepted)\
+        .filter(jorm.JobApplication.id == job_application_id).first()
+
+    if accepted is None:
+        accepted = db_session.query(jorm.ArchivedJobApplication.accepted)\
+            .filter(jorm.ArchivedJobApplication.id == job_application_id).first()
+
+    return accepted
+
+
+def _submission_response(job_application_id):
+    """
+    Create the response to a submission of a job application that was already received.
+
+    :param str job_application_id: the id of the job application first submitted
+    :return: the verdict of the job application, or its status URL while it is queued
+    :rtype: tuple
+    """
+    headers = {'Idempotent-Replayed': 'true'}
+    accepted = _get_verdict(job_application_id)
+
+    if accepted is not None:
+        response = jau.create_return_object(data={'id': job_application_id, 'accepted': accepted[0]})
+        return response, 200, headers
+
+    status_url = '{}/{}/status'.format(connexion.request.base_url.rsplit('/', 1)[0], job_application_id)
+    headers['Location'] = status_url
+    response = jau.create_return_object(data={'id': job_application_id, 'status_url': status_url})
+    return response, 202, headers
+
+
+def _find_submission(content_hash, idempotency_key):
+    """
+    Find an earlier submission, within the deduplication window, that a job application repeats.
+
+    :param str content_hash: content hash of the job application
+    :param str idempotency_key: the Idempotency-Key header, or None
+    :return: the response to the earlier submission, or None if the job application is new
+    :rtype: tuple
+    """
+    state = get_state()
+    if state.dedup_window <= 0:
+        return None
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=state.dedup_window)
+
+    if idempotency_key is not None:
+        key = db_session.query(jorm.IdempotencyKey).filter(jorm.IdempotencyKey.key == idempotency_key,
+                                                           jorm.IdempotencyKey.created_at >= since).one_or_none()
+        if key is not None and key.content_hash != content_hash:
+            error_response = jau.create_return_object(
+                error_status=True,
+                error_cause="Idempotency-Key was used for another job application",
+                error_message="Unprocessable Entity")
+            return error_response, 422
+        if key is not None:
+            return _submission_response(key.job_application_id)
+
+    duplicate = db_session.query(jorm.JobApplication.id)\
+        .filter(jorm.JobApplication.content_hash == content_hash, jorm.JobApplication.created_at >= since)\
+        .order_by(jorm.JobApplication.created_at.desc()).first()
+
+    if duplicate is None and state.async_ingestion:
+        duplicate = db_session.query(jorm.IngestionQueueItem.job_application_id)\
+            .filter(jorm.IngestionQueueItem.content_hash == content_hash,
+                    jorm.IngestionQueueItem.enqueued_at >= since,
+                    jorm.IngestionQueueItem.status != jorm.IngestionQueueItem.FAILED)\
+            .order_by(jorm.IngestionQueueItem.id.desc()).first()
+
+    if duplicate is not None:
+        return _submission_response(duplicate[0])
+
+    return None
+
+
+def _find_batch_submissions(content_hashes):
+    """
+    Find the earlier job applications, within the deduplication window, that the job applications of a batch repeat.
+
+    :param list content_hashes: content hashes of the job applications
+    :return: content hashes and the (id, accepted) tuple of the most recent job application with the hash
+    :rtype: dict
+    """
+    state = get_state()
+    if state.dedup_window <= 0:
+        return dict()
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=state.dedup_window)
+    content_hashes = list(set(content_hashes))
+    submissions = dict()
+
+    for i in range(0, len(content_hashes), state.batch_chunk_size):
+        # Oldest first, so the most recent job application with a hash is kept
+        for job_application_id, content_hash, accepted in db_session.query(jorm.JobApplication.id,
+                                                                           jorm.JobApplication.content_hash,
+                                                                           jorm.JobApplication.accepted)\
+                .filter(jorm.JobApplication.content_hash.in_(content_hashes[i:i + state.batch_chunk_size]),
+                        jorm.JobApplication.created_at >= since)\
+                .order_by(jorm.JobApplication.created_at):
+            submissions[content_hash] = (job_application_id, accepted)
+
+    return submissions
+
+
+def _repeated_result(job_application_id, result):
+    """
+    Create the batch result of a job application repeating another one.
+
+    :param str job_application_id: the id of the repeating job application
+    :param dict result: the batch result of the job application it repeats
+    :return: the verdict of the job application it repeats
+    :rtype: dict
+    """
+    if result['status'] == 'error':
+        return dict(result, id=job_application_id)
+
+    return {'id': job_application_id, 'status': result['status'], 'code': 200, 'message': None,
+            'duplicate_of': result['id']}
+
+
+def _save_idempotency_key(idempotency_key, job_application):
+    """
+    Remember the job application an Idempotency-Key created, as part of the current transaction.
+
+    Keys older than the deduplication window are removed at the same time.
+
+    :param str idempotency_key: the Idempotency-Key header
+    :param dict job_application: the job application, including its id and content hash
+    """
+    now = datetime.datetime.utcnow()
+    db_session.query(jorm.IdempotencyKey)\
+        .filter(jorm.IdempotencyKey.created_at < now - datetime.timedelta(seconds=get_state().dedup_window))\
+        .delete(synchronize_session=False)
+    db_session.add(jorm.IdempotencyKey(key=idempotency_key,
+                                       job_application_id=job_application['id'],
+                                       content_hash=job_application['content_hash'],
+                                       created_at=now))
+
+
+def _resolve_conflict(error, job_application, idempotency_key):
+    """
+    Roll back a submission that failed to commit, and answer it with the submission it collided with.
+
+    :param IntegrityError error: the error the commit failed with
+    :param dict job_application: the job application that could not be saved
+    :param str idempotency_key: the Idempotency-Key header, or None
+    :return: the response to the concurrent submission
+    :rtype: tuple
+    :raises IntegrityError: the error, if the submission didn't collide with one that repeats it
+    """
+    db_session.rollback()
+    submission = _find_submission(job_application['content_hash'], idempotency_key)
+    if submission is None:
+        raise error
+
+    return submission
+
+
 def put_job_application(job_application_id, job_application):
     """
     Validate and save a job application.
 
+    A new job application with the same content as one submitted within the
+    deduplication window, or sent again with the same Idempotency-Key header, is
+    not scored or saved again; the verdict of the first submission is returned.
+
     :param str job_application_id: the id of the job application
     :param dict job_application: the job application
     :return: result of the application: accepted or rejected
     :rtype: dict
     """
     logging.info("put_job_application endpoint called")
+    state = get_state()
 
-    db_response = db_session.query(jorm.JobApplication).filter(jorm.JobApplication.id == job_application_id).one_or_none()
     job_application['id'] = job_application_id
+    job_application['content_hash'] = jau.content_hash(job_application)
+
+    idempotency_key = connexion.request.headers.get('Idempotency-Key') or None
+    if idempotency_key is not None and len(idempotency_key) > 255:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause="Idempotency-Key is longer than 255 characters",
+                                                  error_message="Bad Request")
+        return error_response, 400
+
+    db_response = db_session.query(jorm.JobApplication).filter(jorm.JobApplication.id == job_application_id).one_or_none()
+
+    if db_response is None or idempotency_key is not None:
+        submission = _find_submission(job_application['content_hash'], idempotency_key)
+        if submission is not None:
+            logging.info("Job application {} repeats an earlier submission".format(job_application_id))
+            return submission
+
+    if db_response is None:
+        # Applications to a job posting are scored against the posting's questions
+        rule_set = state.get_rule_set(job_application.get('job_posting_id'))
+        if rule_set is None:
+            error_cause = "Unknown job posting {}".format(job_application['job_posting_id'])
+        else:
+            unknown_ids = [applicant_response['id'] for applicant_response in job_application['applicant_responses']
+                           if applicant_response['id'] not in rule_set]
+            error_cause = "Unknown questions {}".format(', '.join(unknown_ids)) if unknown_ids else None
+
+        if error_cause is not None:
+            error_response = jau.create_return_object(error_status=True,
+                                                      error_cause=error_cause,
+                                                      error_message="Bad Request")
+            return error_response, 400
 
     if db_response is not None:
         logging.info("Updating job application {}".format(job_application_id))
+        job_application['updated_at'] = datetime.datetime.utcnow()
         db_response.update(**job_application)
         response = jau.create_return_object()
+    elif state.async_ingestion:
+        queued = state.ingestion_queue.find(job_application_id)
+
+        if queued is None or queued.status == jorm.IngestionQueueItem.FAILED:
+            logging.info("Queueing job application {}".format(job_application_id))
+            state.ingestion_queue.enqueue(job_application)
+            if idempotency_key is not None and state.dedup_window > 0:
+                _save_idempotency_key(idempotency_key, job_application)
+            try:
+                db_session.commit()
+            except IntegrityError as e:
+                return _resolve_conflict(e, job_application, idempotency_key)
+            state.ingestion_queue.notify()
+
+        status_url = '{}/status'.format(connexion.request.base_url)
+        response = jau.create_return_object(data={'id': job_application_id, 'status_url': status_url})
+        return response, 202, {'Location': status_url}
     else:
         logging.info("Creating job application {}".format(job_application_id))
         job_application['created_at'] = datetime.datetime.utcnow()
         job_application['updated_at'] = datetime.datetime.utcnow()
 
-        all_questions = get_questions()
-
-        application_questions = dict()
-        for question in all_questions[0]['data']['questions']:
-            application_questions[question['id']] = question['answer']
-
-        scored_application = jau.score_job_application(application_questions=application_questions,
-                                                       job_application=job_application)
+        scored_application = jau.score_job_application(application_questions=rule_set,
+                                                       job_application=job_application,
+                                                       mode=state.scoring_mode,
+                                                       cache=state.verdict_cache)
+        logging.info("Scored job application {} with rule version {}"
+                     .format(job_application_id, scored_application['rule_version']))
 
         db_session.add(jorm.JobApplication(**scored_application))
-        response = jau.create_return_object()
+        if idempotency_key is not None and state.dedup_window > 0:
+            _save_idempotency_key(idempotency_key, job_application)
+        response = jau.create_return_object(data={'id': job_application_id,
+                                                  'accepted': scored_application['accepted']})
 
-    db_session.commit()
+    jorm.bump_table_version(db_session, 'job_applications')
+    try:
+        db_session.commit()
+    except IntegrityError as e:
+        return _resolve_conflict(e, job_application, idempotency_key)
 
     return response, (200 if job_application is not None else 201)
 
 
+def get_job_application_status(job_application_id):
+    """
+    Get the processing status of a submitted job application.
+
+    :param str job_application_id: the id of the job application
+    :return: queued, processing, failed, accepted or rejected
+    :rtype: dict
+    """
+    logging.info("get_job_application_status endpoint called")
+
+    response_data = nested_dict()
+    response_data['id'] = job_application_id
+    response_data['error'] = None
+
+    accepted = _get_verdict(job_application_id)
+    queued = get_state().ingestion_queue.find(job_application_id)
+
+    if accepted is not None:
+        response_data['status'] = 'accepted' if accepted[0] else 'rejected'
+    elif queued is not None:
+        response_data['status'] = {jorm.IngestionQueueItem.PENDING: 'queued',
+                                   jorm.IngestionQueueItem.PROCESSING: 'processing',
+                                   jorm.IngestionQueueItem.FAILED: 'failed'}[queued.status]
+        response_data['error'] = queued.error
+    else:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_message="Not Found")
+        return error_response, 404
+
+    return jau.create_return_object(data=response_data), 200
+
+
+def get_ingestion_queue():
+    """
+    Get the depth and lag of the ingestion queue.
+
+    :return: queue statistics
+    :rtype: dict
+    """
+    logging.info("get_ingestion_queue endpoint called")
+
+    state = get_state()
+    response_data = nested_dict()
+    response_data['enabled'] = state.async_ingestion
+    response_data.update(state.ingestion_queue.stats())
+
+    return jau.create_return_object(data=response_data), 200
+
+
+def get_archive():
+    """
+    Get the number and size of the archived job applications.
+
+    :return: archive statistics
+    :rtype: dict
+    """
+    logging.info("get_archive endpoint called")
+
+    archiver = get_state().archiver
+    response_data = nested_dict()
+    response_data['enabled'] = archiver.enabled
+    response_data.update(archiver.stats())
+
+    return jau.create_return_object(data=response_data), 200
+
+
+def _parse_job_applications_batch(job_applications):
+    """
+    Parse the body of a batch submission.
+
+    :param job_applications: the request body: a JSON array, or NDJSON with one application per line
+    :return: the submitted job applications
+    :rtype: list
+    """
+    if isinstance(job_applications, list):
+        return job_applications
+
+    if isinstance(job_applications, bytes):
+        job_applications = job_applications.decode('utf-8')
+
+    content_type = connexion.request.headers.get('Content-Type', '')
+    if content_type.startswith('application/x-ndjson'):
+        return [json.loads(line) for line in job_applications.splitlines() if line.strip()]
+
+    submitted = json.loads(job_applications)
+    if not isinstance(submitted, list):
+        raise ValueError("Expected an array of job applications")
+
+    return submitted
+
+
+def post_job_applications_batch(job_applications):
+    """
+    Validate and save a batch of job applications.
+
+    Applications are scored in chunks across a process pool, and each chunk is
+    saved in a single transaction. A job application with the same content as one
+    submitted within the deduplication window, earlier or in the same batch, is not
+    scored or saved again; the verdict of the first submission is reported.
+
+    :param job_applications: the job applications, as a JSON array or NDJSON
+    :return: the accepted, rejected or error result of each job application
+    :rtype: dict
+    """
+    logging.info("post_job_applications_batch endpoint called")
+    state = get_state()
+    started = time.time()
+
+    try:
+        submitted = _parse_job_applications_batch(job_applications)
+    except ValueError as e:
+        error_response = jau.create_return_object(error_status=True,
+                                                  error_cause=str(e),
+                                                  error_message="Invalid batch")
+        return error_response, 400
+
+    # Results are reported in submission order
+    results = [None] * len(submitted)
+    valid_positions = list()
+    valid_applications = list()
+    seen_ids = set()
+
+    for position, job_application in enumerate(submitted):
+        # Checked before hashing or scoring, connexion doesn't validate the items of the batch
+        error = jau.validate_job_application(job_application)
+        if error is not None:
+            job_application_id = job_application.get('id') if isinstance(job_application, dict) else None
+            results[position] = {'id': job_application_id if isinstance(job_application_id, str) else None,
+                                 'status': 'error', 'code': 400, 'message': error}
+        elif job_application['id'] in seen_ids:
+            results[position] = {'id': job_application['id'], 'status': 'error', 'code': 400,
+                                 'message': 'Duplicate id in batch'}
+        else:
+            seen_ids.add(job_application['id'])
+            job_application['content_hash'] = jau.content_hash(job_application)
+            valid_positions.append(position)
+            valid_applications.append(job_application)
+
+    # Repeats of earlier submissions get their verdict, repeats within the batch that of their first occurrence
+    submissions = _find_batch_submissions([job_application['content_hash'] for job_application in valid_applications])
+    first_positions = dict()
+    repeats = list()
+    new_positions = list()
+    new_applications = list()
+
+    for position, job_application in zip(valid_positions, valid_applications):
+        submission = submissions.get(job_application['content_hash'])
+        if submission is not None:
+            earlier_result = {'id': submission[0], 'status': 'accepted' if submission[1] else 'rejected'}
+            results[position] = _repeated_result(job_application['id'], earlier_result)
+        elif state.dedup_window > 0 and job_application['content_hash'] in first_positions:
+            repeats.append((position, first_positions[job_application['content_hash']]))
+        else:
+            first_positions.setdefault(job_application['content_hash'], position)
+            new_positions.append(position)
+            new_applications.append(job_application)
+
+    valid_positions = new_positions
+    valid_applications = new_applications
+
+    chunk_size = state.batch_chunk_size
+    chunks = [valid_applications[i:i + chunk_size] for i in range(0, len(valid_applications), chunk_size)]
+    chunk_positions = [valid_positions[i:i + chunk_size] for i in range(0, len(valid_positions), chunk_size)]
+
+    score_chunk = partial(jau.score_job_applications, state.get_qualification_set(), mode=state.scoring_mode,
+                          rule_sets=state.get_rule_sets(valid_applications))
+    if state.scoring_pool is not None and len(chunks) > 1:
+        # Each scoring process uses its own verdict cache
+        scored_chunks = state.scoring_pool.map(score_chunk, chunks)
+    else:
+        scored_chunks = map(partial(score_chunk, cache=state.verdict_cache), chunks)
+
+    for chunk, positions, scored_chunk in zip(chunks, chunk_positions, scored_chunks):
+        chunk_ids = [job_application['id'] for job_application in chunk]
+        existing_ids = set(row.id for row in
+                           db_session.query(jorm.JobApplication.id).filter(jorm.JobApplication.id.in_(chunk_ids)))
+
+        chunk_results = list()
+        now = datetime.datetime.utcnow()
+
+        for job_application, (scored_application, error) in zip(chunk, scored_chunk):
+            if job_application['id'] in existing_ids:
+                chunk_results.append({'id': job_application['id'], 'status': 'error', 'code': 409,
+                                      'message': 'Already exists'})
+            elif error is not None:
+                chunk_results.append({'id': job_application['id'], 'status': 'error', 'code': 400, 'message': error})
+            else:
+                scored_application['created_at'] = now
+                scored_application['updated_at'] = now
+                db_session.add(jorm.JobApplication(**scored_application))
+                chunk_results.append({'id': job_application['id'],
+                                      'status': 'accepted' if scored_application['accepted'] else 'rejected',
+                                      'code': 201, 'message': None})
+
+        try:
+            jorm.bump_table_version(db_session, 'job_applications')
+            db_session.commit()
+        except SQLAlchemyError as e:
+            logging.error("Could not save batch chunk: {}".format(e))
+            db_session.rollback()
+            chunk_results = [{'id': job_application['id'], 'status': 'error', 'code': 500,
+                              'message': 'Could not be saved'} for job_application in chunk]
+
+        for position, result in zip(positions, chunk_results):
+            results[position] = result
+
+    for position, first_position in repeats:
+        results[position] = _repeated_result(submitted[position]['id'], results[first_position])
+
+    elapsed = time.time() - started
+    applications_per_second = len(submitted) / elapsed if elapsed > 0 else 0.0
+    logging.info("Processed a batch of {} job applications at {:.1f} applications/s"
+                 .format(len(submitted), applications_per_second))
+
+    response_data = nested_dict()
+    response_data['results'] = results
+    response_data['accepted'] = sum(1 for result in results if result['status'] == 'accepted')
+    response_data['rejected'] = sum(1 for result in results if result['status'] == 'rejected')
+    response_data['errors'] = sum(1 for result in results if result['status'] == 'error')
+    response_data['elapsed_seconds'] = elapsed
+    response_data['applications_per_second'] = applications_per_second
+
+    return jau.create_return_object(data=response_data), 200
+
+
 def delete_job_application(job_application_id):
     """
     Delete a job application.
@@ -235,10 +1540,18 @@ def delete_job_application(job_application_id):
     logging.info("delete_job_application endpoint called")
 
     db_response = db_session.query(jorm.JobApplication).filter(jorm.JobApplication.id == job_application_id).one_or_none()
+    archived = db_session.query(jorm.ArchivedJobApplication.id)\
+        .filter(jorm.ArchivedJobApplication.id == job_application_id).first()
 
-    if db_response is not None:
+    if db_response is not None or archived is not None:
         logging.info('Deleting job application {}', job_application_id)
+        db_session.query(jorm.ApplicantResponse)\
+            .filter(jorm.ApplicantResponse.job_application_id == job_application_id).delete()
         db_session.query(jorm.JobApplication).filter(jorm.JobApplication.id == job_application_id).delete()
+        db_session.query(jorm.ArchivedJobApplication)\
+            .filter(jorm.ArchivedJobApplication.id == job_application_id).delete()
+        get_state().search_index.update(db_session, [job_application_id])
+        jorm.bump_table_version(db_session, 'job_applications')
         db_session.commit()
         response = jau.create_return_object()
         return response, 200
@@ -248,29 +1561,269 @@ def delete_job_application(job_application_id):
         return response, 404
 
 
-logging.basicConfig(level=logging.INFO)
-db_session = jorm.init_db('sqlite:///:memory:')
-app_port = int(getenv('API_PORT', 8080))
+def start_request_timer():
+    flask.g.request_started = time.perf_counter()
+
+
+def observe_request(response):
+    started = getattr(flask.g, 'request_started', None)
+    rule = flask.request.url_rule
+    if started is not None and rule is not None:
+        endpoint = rule.endpoint.rsplit('.', 1)[-1]
+        operation_id = get_state().operation_ids.get(endpoint)
+        if operation_id is not None:
+            jmet.request_duration.observe(time.perf_counter() - started,
+                                          operation_id, flask.request.method, str(response.status_code))
+    return response
+
+
+def get_metrics():
+    """
+    Get the API's metrics in the Prometheus text format.
+    """
+    metrics = jmet.registry.render() + get_state().registry.render()
+    return flask.Response(metrics, mimetype='text/plain; version=0.0.4')
 
-app = connexion.FlaskApp(__name__,
-                        specification_dir='.',
-                        server='tornado')
 
-app.add_api('jobber_api.yaml',
-            strict_validation=True,
-            swagger_json=True)
+def get_profile():
+    """
+    Get the stacks sampled by the profiler, in the collapsed format of flame graph tools.
+    """
+    profiler = get_state().profiler
+    if profiler is None:
+        return flask.Response("Profiler disabled, set PROFILER_INTERVAL to enable it\n", status=404,
+                              mimetype='text/plain')
 
-application = app.app
+    reset = flask.request.args.get('reset', 'false').lower() in ('1', 'true', 'yes')
+    return flask.Response(profiler.collapsed(reset=reset), mimetype='text/plain')
 
 
-@application.teardown_appcontext
 def shutdown_session(exception=None):
     db_session.remove()
 
 
-def run_server():
-    # Run Jobber
-    app.run(port=app_port)
+def _setting(config, name, default):
+    """
+    Read a setting from the config, falling back to the environment variable of the same name.
+
+    :param dict config: the settings given to create_app
+    :param str name: name of the setting
+    :param default: value of the setting when neither has it
+    :return: the value of the setting
+    """
+    if name in config:
+        return config[name]
+    return getenv(name, default)
+
+
+def _enabled(config, name, default):
+    return str(_setting(config, name, default)).lower() in ('1', 'true', 'yes')
+
+
+def _load_specification(spec_path, cache_path=None):
+    """
+    Load the OpenAPI specification, from its JSON cache when the cache is up to date.
+
+    :param str spec_path: path of jobber_api.yaml
+    :param str cache_path: path of the JSON cache, or None to always parse the YAML
+    :return: tuple (the specification, True if it comes from the cache)
+    """
+    with open(spec_path, 'rb') as spec_file:
+        source = spec_file.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+
+    if cache_path:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached.get('source_hash') == source_hash:
+                return cached['specification'], True
+        except (OSError, ValueError):
+            logging.info("Specification cache {} is missing or unreadable, parsing {}".format(cache_path, spec_path))
+
+    # libyaml's loader, when PyYAML was built with it, parses several times faster
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    specification = yaml.load(source, Loader=loader)
+
+    if cache_path:
+        # Written next to the cache, then renamed over it, so workers never read half a file
+        temporary_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(temporary_path, 'w') as cache_file:
+            json.dump({'source_hash': source_hash, 'specification': specification}, cache_file, default=str)
+        os.replace(temporary_path, cache_path)
+
+    return specification, False
+
+
+@contextmanager
+def _specification_validated():
+    """
+    Skip connexion's validation of a specification that was validated before it was cached.
+    """
+    validate_spec = connexion.apis.abstract.validate_spec
+    connexion.apis.abstract.validate_spec = lambda spec: None
+    try:
+        yield
+    finally:
+        connexion.apis.abstract.validate_spec = validate_spec
+
+
+def create_app(config=None):
+    """
+    Create the Jobber API: open the database, start the background threads and build the connexion app.
+
+    The app's state is a JobberState kept in the Flask app's extensions under 'jobber', so apps
+    created in the same process, e.g. one per test, are independent of each other. Its close
+    method stops the app's background threads and closes its database connections.
+
+    :param dict config: settings overriding the environment variables of the same names, see the README
+    :return: the connexion app
+    :rtype: connexion.FlaskApp
+    """
+    config = config or dict()
+
+    database_url = _setting(config, 'DATABASE_URL',
+                            'sqlite:///{}/{}'.format(_setting(config, 'DB_DIR', './data'),
+                                                     _setting(config, 'DB_FILE_NAME', 'jobber.db')))
+    async_ingestion = _enabled(config, 'ASYNC_INGESTION', 'false')
+    background_workers = not jorm.is_in_memory(database_url)
+    if not background_workers:
+        if async_ingestion:
+            raise ValueError("ASYNC_INGESTION needs a database file, an in-memory database has no ingestion workers")
+        logging.warning("In-memory database: no background workers, job applications are not re-scored or archived")
+
+    db_session = jorm.init_db(database_url,
+                              pool_size=int(_setting(config, 'DB_POOL_SIZE', 5)),
+                              max_overflow=int(_setting(config, 'DB_MAX_OVERFLOW', 10)),
+                              pool_timeout=int(_setting(config, 'DB_POOL_TIMEOUT', 30)),
+                              pool_recycle=int(_setting(config, 'DB_POOL_RECYCLE', -1)),
+                              journal_mode=_setting(config, 'SQLITE_JOURNAL_MODE', 'WAL'),
+                              synchronous=_setting(config, 'SQLITE_SYNCHRONOUS', 'NORMAL'),
+                              mmap_size=int(_setting(config, 'SQLITE_MMAP_SIZE', 268435456)),
+                              busy_timeout=int(_setting(config, 'SQLITE_BUSY_TIMEOUT', 5000)))
+
+    state = JobberState(db_session,
+                        batch_workers=int(_setting(config, 'BATCH_WORKERS', cpu_count() or 1)),
+                        batch_chunk_size=int(_setting(config, 'BATCH_CHUNK_SIZE', 500)),
+                        export_chunk_size=int(_setting(config, 'EXPORT_CHUNK_SIZE', 1000)),
+                        export_watermark_lag=float(_setting(config, 'EXPORT_WATERMARK_LAG', 30)),
+                        scoring_mode=_setting(config, 'SCORING_MODE', jau.FULL_SCORING),
+                        verdict_cache_size=int(_setting(config, 'VERDICT_CACHE_SIZE', 10000)),
+                        async_ingestion=async_ingestion,
+                        dedup_window=int(_setting(config, 'DEDUP_WINDOW_SECONDS', 600)),
+                        background_workers=background_workers)
+
+    state.search_index = jsearch.SearchIndex(db_session)
+    if _enabled(config, 'FULL_TEXT_SEARCH', 'true'):
+        state.search_index.setup()
+
+    # Requests of each class that may wait for their turn, and for how many seconds, 0 for no limit
+    if _enabled(config, 'ADMISSION_CONTROL', 'true'):
+        state.admission = jserv.AdmissionController(
+            max_queued={jserv.READ: int(_setting(config, 'ADMISSION_READ_QUEUE', 500)),
+                        jserv.WRITE: int(_setting(config, 'ADMISSION_WRITE_QUEUE', 100))},
+            max_wait={jserv.READ: float(_setting(config, 'ADMISSION_READ_TIMEOUT', 10)),
+                      jserv.WRITE: float(_setting(config, 'ADMISSION_WRITE_TIMEOUT', 2))},
+            retry_after=int(_setting(config, 'ADMISSION_RETRY_AFTER', 1)))
+
+    spec_dir = os.path.dirname(os.path.abspath(__file__))
+    specification, cached = _load_specification(os.path.join(spec_dir, 'jobber_api.yaml'),
+                                                _setting(config, 'SPEC_CACHE', '') or None)
+
+    app = connexion.FlaskApp(__name__,
+                             specification_dir=spec_dir,
+                             server='tornado')
+
+    if cached:
+        with _specification_validated():
+            api = app.add_api(specification, strict_validation=True, swagger_json=True)
+    else:
+        api = app.add_api(specification, strict_validation=True, swagger_json=True)
+
+    application = app.app
+    application.extensions['jobber'] = state
+    application.config['API_PORT'] = int(_setting(config, 'API_PORT', 8080))
+    application.config['API_WORKERS'] = int(_setting(config, 'API_WORKERS', 1))
+
+    # connexion registers every operation as a Flask endpoint named after its operationId
+    for path_item in api.specification['paths'].values():
+        for operation in path_item.values():
+            if isinstance(operation, dict) and 'operationId' in operation:
+                state.operation_ids[operation['operationId'].replace('.', '_')] = operation['operationId']
+
+    application.before_request(start_request_timer)
+    application.after_request(observe_request)
+    application.add_url_rule('/metrics', 'get_metrics', get_metrics)
+    application.add_url_rule('/profile', 'get_profile', get_profile)
+    application.teardown_appcontext(shutdown_session)
+
+    jmet.instrument_engine(db_session.get_bind())
+    jmet.instrument_session(db_session)
+
+    profiler_interval = float(_setting(config, 'PROFILER_INTERVAL', 0))
+    if profiler_interval > 0:
+        state.profiler = jmet.SamplingProfiler(interval=profiler_interval)
+
+    state.ingestion_queue = jing.IngestionQueue(db_session,
+                                                state.score_queued_applications,
+                                                workers=int(_setting(config, 'INGESTION_WORKERS', 2)),
+                                                batch_size=int(_setting(config, 'INGESTION_BATCH_SIZE', 100)),
+                                                poll_interval=float(_setting(config, 'INGESTION_POLL_INTERVAL', 0.5)))
+
+    state.rescorer = jres.Rescorer(db_session,
+                                   state.get_qualification_set,
+                                   mode=state.scoring_mode,
+                                   cache=state.verdict_cache,
+                                   chunk_size=int(_setting(config, 'RESCORE_CHUNK_SIZE', 500)),
+                                   chunk_pause=float(_setting(config, 'RESCORE_CHUNK_PAUSE', 0.05)))
+
+    state.archiver = jarc.Archiver(db_session,
+                                   search_index=state.search_index,
+                                   rejected_after=int(_setting(config, 'ARCHIVE_REJECTED_AFTER', 0)),
+                                   accepted_after=int(_setting(config, 'ARCHIVE_ACCEPTED_AFTER', 0)),
+                                   batch_size=int(_setting(config, 'ARCHIVE_BATCH_SIZE', 500)),
+                                   batch_pause=float(_setting(config, 'ARCHIVE_BATCH_PAUSE', 0.05)),
+                                   interval=float(_setting(config, 'ARCHIVE_INTERVAL', 3600)))
+
+    state.start_background_threads()
+
+    return app
+
+
+def warm_up(app):
+    """
+    Prepare a created app for its first requests: import the scoring libraries and compile the rules.
+
+    :param connexion.FlaskApp app: the app, from create_app
+    """
+    jau.load_scoring_libraries()
+    app.app.extensions['jobber'].preload_rule_sets()
+
+
+def run_server(config=None):
+    """
+    Create the app and serve it until the process is stopped.
+
+    :param dict config: settings overriding the environment variables of the same names
+    """
+    config = config or dict()
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(config)
+    state = app.app.extensions['jobber']
+    api_workers = app.app.config['API_WORKERS']
+
+    if _enabled(config, 'WARM_UP', 'true'):
+        # Done before serving, as the request threads read and fill the same rule caches. Workers
+        # forked from this process inherit the imported libraries and compiled rules
+        warm_up(app)
+
+    # Run Jobber, streaming exports instead of buffering them
+    jserv.run(app.app, app.app.config['API_PORT'],
+              workers=api_workers,
+              before_fork=state.stop_background_threads,
+              after_fork=state.start_background_threads,
+              admission=state.admission)
+
 
 if __name__ == '__main__':
     run_server()
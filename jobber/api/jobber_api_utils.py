@@ -5,9 +5,39 @@ Handy functions used by the Jobber API.
 
 """
 
-from fuzzywuzzy import fuzz
+import base64
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
 from statistics import mean
 from copy import deepcopy
+import jobber_metrics as jmet
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Imported by load_scoring_libraries on first use, so importing this module stays fast
+np = None
+fuzz = None
+utils = None
+
+# Minimum partial token set ratio for an answer to pass
+PASSING_RATIO = 80
+
+# Compute every fuzzy ratio for every answer
+FULL_SCORING = 'full'
+# Compute only what the accept/reject decision needs and stop at the first failing answer
+DECISION_SCORING = 'decision'
+SCORING_MODES = (FULL_SCORING, DECISION_SCORING)
+
+# Ids the /job-applications/{job_application_id} path accepts, matched as a whole
+JOB_APPLICATION_ID_PATTERN = re.compile(r'[a-zA-Z0-9-]+')
 
 
 def create_return_object(error_status=False, error_cause=None, error_message=None, data=None):
@@ -47,6 +77,373 @@ def create_return_object(error_status=False, error_cause=None, error_message=Non
     return return_object
 
 
+def format_datetime(value):
+    """
+    Format a datetime the way connexion's JSON encoder does, naive datetimes are UTC.
+
+    :param datetime.datetime value: the datetime, or None
+    :return: str the ISO 8601 representation, or None
+    """
+    if value is None:
+        return None
+    return value.isoformat('T') if value.tzinfo else value.isoformat('T') + 'Z'
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return format_datetime(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def dumps_json(value):
+    """
+    Encode a response body as compact JSON with sorted keys, using orjson when it is installed.
+
+    :param value: the response body, e.g. from create_return_object
+    :return: bytes the UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    return json.dumps(value, default=_json_default, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 timestamp as given in query parameters.
+
+    :param str value: the timestamp, e.g. 2017-04-08T18:33:43.303353Z
+    :return: datetime the naive UTC timestamp
+    :raises ValueError: if the timestamp can't be parsed
+    """
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1]
+
+    for timestamp_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+
+    raise ValueError("Invalid timestamp {}".format(value))
+
+
+def encode_cursor(created_at, record_id):
+    """
+    Create an opaque pagination cursor pointing after a record.
+
+    :param datetime created_at: creation time of the last record on the page
+    :param str record_id: id of the last record on the page
+    :return: str the cursor
+    """
+    position = [created_at.strftime('%Y-%m-%dT%H:%M:%S.%f'), record_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Read the position out of a pagination cursor.
+
+    :param str cursor: a cursor created by encode_cursor
+    :return: tuple (created_at, record id)
+    :raises ValueError: if the cursor is invalid
+    """
+    try:
+        created_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+    return parse_datetime(created_at), record_id
+
+
+def _normalize_text(value):
+    return ' '.join(str(value or '').split())
+
+
+def content_hash(job_application):
+    """
+    Fingerprint the content of a job application, to recognise resubmissions of it.
+
+    The id is left out, so the same application submitted twice under different ids
+    has the same hash, while applying to another job posting makes a different one.
+    Whitespace is collapsed in the name and the answers, the name is compared
+    case-insensitively, and the order of the responses doesn't matter.
+
+    :param dict job_application: job application data
+    :return: str hex SHA-256 digest
+    """
+    responses = sorted((str(applicant_response.get('id')), _normalize_text(applicant_response.get('answer')))
+                       for applicant_response in job_application.get('applicant_responses') or ())
+    content = [_normalize_text(job_application.get('name')).casefold(), responses]
+    if job_application.get('job_posting_id') is not None:
+        content.append(job_application['job_posting_id'])
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def validate_job_application(job_application):
+    """
+    Check the fields of a job application that hashing and scoring rely on.
+
+    Follows the JobApplication definition of the specification, for job applications
+    connexion doesn't validate, such as the items of an NDJSON batch.
+
+    :param job_application: the submitted job application
+    :return: str what is wrong with the job application, naming the field, or None if it is valid
+    """
+    if not isinstance(job_application, dict):
+        return "Job application must be an object"
+
+    for field in ('id', 'name'):
+        value = job_application.get(field)
+        if not isinstance(value, str) or not 1 <= len(value) <= 255:
+            return "{} must be a string of 1 to 255 characters".format(field)
+
+    if not JOB_APPLICATION_ID_PATTERN.fullmatch(job_application['id']):
+        return "id must only contain letters, digits and hyphens"
+
+    job_posting_id = job_application.get('job_posting_id')
+    if job_posting_id is not None and not isinstance(job_posting_id, str):
+        return "job_posting_id must be a string"
+
+    applicant_responses = job_application.get('applicant_responses')
+    if not isinstance(applicant_responses, list):
+        return "applicant_responses must be an array"
+
+    for position, applicant_response in enumerate(applicant_responses):
+        field = 'applicant_responses[{}]'.format(position)
+        if not isinstance(applicant_response, dict):
+            return "{} must be an object".format(field)
+        if not isinstance(applicant_response.get('id'), str):
+            return "{}.id must be a string".format(field)
+        answer = applicant_response.get('answer')
+        if not isinstance(answer, str) or not 1 <= len(answer) <= 255:
+            return "{}.answer must be a string of 1 to 255 characters".format(field)
+
+    return None
+
+
+def _answer_tokens(answer):
+    """
+    Split an answer into the tokens the containment check compares.
+
+    Answers are lowercased and split on single spaces. Punctuation stays part of the
+    token it is attached to, on both sides of the comparison, so the stored
+    answer_in_response values remain valid.
+
+    :param str answer: an answer
+    :return: frozenset of tokens
+    """
+    return frozenset(answer.lower().split(" "))
+
+
+class CompiledQuestion(object):
+    """
+    A question's acceptable answer, pre-processed once for scoring.
+    """
+    # Qualification sets hold a rule per question of every job posting
+    __slots__ = ('id', 'answer', 'normalized_answer', 'answer_tokens', 'accepts_any', 'version')
+
+    def __init__(self, question_id, answer, version=0):
+        """
+        :param str question_id: id of the question
+        :param str answer: the acceptable answer to the question
+        :param int version: version of the qualification set the rule was compiled in
+        """
+        self.id = question_id
+        self.answer = answer
+        self.normalized_answer = answer.lower()
+        self.answer_tokens = _answer_tokens(answer)
+        self.accepts_any = self.normalized_answer == "any"
+        self.version = version
+
+
+class QualificationSet(object):
+    """
+    The compiled acceptable answers of every question, used to score job applications.
+    """
+
+    def __init__(self, questions=None, version=0):
+        """
+        :param dict questions: question ids and their acceptable answers
+        :param int version: version of the question set the rules were built from
+        """
+        self.version = version
+        self.rules = dict()
+
+        for question_id, answer in (questions or dict()).items():
+            self.rules[question_id] = CompiledQuestion(question_id, answer, version)
+
+    def add(self, question_id, answer, version):
+        """
+        Add or replace the rule for a question.
+
+        :param str question_id: id of the question
+        :param str answer: the acceptable answer to the question
+        :param int version: the new version of the question set
+        """
+        existing_rule = self.rules.get(question_id)
+        if existing_rule is None or existing_rule.answer != answer:
+            self.rules[question_id] = CompiledQuestion(question_id, answer, version)
+        self.version = version
+
+    def remove(self, question_id, version):
+        """
+        Remove the rule for a question.
+
+        :param str question_id: id of the question
+        :param int version: the new version of the question set
+        """
+        self.rules.pop(question_id, None)
+        self.version = version
+
+    def subset(self, question_ids):
+        """
+        Create the qualification set of some of the questions, e.g. a job posting's.
+
+        The subset shares the compiled rules and the version of this set; questions
+        without a rule are left out.
+
+        :param question_ids: ids of the questions
+        :return: QualificationSet
+        """
+        rule_set = QualificationSet(version=self.version)
+        rule_set.rules = dict((question_id, self.rules[question_id]) for question_id in question_ids
+                              if question_id in self.rules)
+        return rule_set
+
+    def __getitem__(self, question_id):
+        return self.rules[question_id]
+
+    def __contains__(self, question_id):
+        return question_id in self.rules
+
+    def __len__(self):
+        return len(self.rules)
+
+
+class VerdictCache(object):
+    """
+    Bounded LRU cache of scored answers.
+
+    Entries are keyed by (question id, rule version, scoring mode, normalized answer) and hold the
+    fuzzy ratios computed for the answer along with its verdict.
+    """
+
+    def __init__(self, maxsize=10000):
+        """
+        :param int maxsize: maximum number of answers to keep, 0 disables the cache
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._keys_by_question = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached answer, marking it as recently used.
+
+        :param tuple key: (question id, rule version, scoring mode, normalized answer)
+        :return: the cached (answer fields, verdict) tuple, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """
+        Cache a scored answer, evicting the least recently used one if the cache is full.
+
+        :param tuple key: (question id, rule version, scoring mode, normalized answer)
+        :param tuple entry: (answer fields, verdict)
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._keys_by_question.setdefault(key[0], set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._discard_key(evicted_key)
+                self.evictions += 1
+
+    def invalidate(self, question_id):
+        """
+        Drop every cached answer to a question.
+
+        :param str question_id: id of the question
+        """
+        with self._lock:
+            for key in self._keys_by_question.pop(question_id, set()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every cached answer.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_question.clear()
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        :return: dict of the cache size, hits, misses and evictions
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _discard_key(self, key):
+        question_keys = self._keys_by_question.get(key[0])
+        if question_keys is not None:
+            question_keys.discard(key)
+            if not question_keys:
+                del self._keys_by_question[key[0]]
+
+
+# Scored answers shared by the scoring calls in this process that aren't given a cache, e.g. in a scoring process
+verdict_cache = VerdictCache()
+
+
+def load_scoring_libraries():
+    """
+    Import numpy and fuzzywuzzy, which only scoring needs.
+
+    Called before the first fuzzy match, or ahead of time to warm up a process.
+    """
+    global np, fuzz, utils
+
+    if fuzz is None:
+        import numpy
+        from fuzzywuzzy import fuzz as fuzz_module, utils as utils_module
+        np = numpy
+        utils = utils_module
+        # Set last, other threads only check fuzz
+        fuzz = fuzz_module
+
+
 def _create_fuzzy_matches(x, y):
     """
     Create fuzzy matches.
@@ -55,6 +452,9 @@ def _create_fuzzy_matches(x, y):
     :param str y: second string to compare
     :return: dict results: dictionary of fuzzy match results
     """
+    if fuzz is None:
+        load_scoring_libraries()
+
     r1 = fuzz.ratio(x, y)
     r2 = fuzz.token_sort_ratio(x, y)
     r3 = fuzz.token_set_ratio(x, y)
@@ -78,70 +478,393 @@ def _create_fuzzy_matches(x, y):
     return results
 
 
+def _partial_token_set_ratio(tokens1, tokens2):
+    """
+    Compute partial_token_set_ratio from the token sets of two fully processed strings.
+
+    Follows fuzz._token_set step by step, so the scores are identical.
+
+    :param set tokens1: tokens of the applicant's answer
+    :param set tokens2: tokens of the acceptable answer
+    :return: int the ratio
+    """
+    intersection = tokens1.intersection(tokens2)
+    diff1to2 = tokens1.difference(tokens2)
+    diff2to1 = tokens2.difference(tokens1)
+
+    sorted_sect = " ".join(sorted(intersection))
+    sorted_1to2 = " ".join(sorted(diff1to2))
+    sorted_2to1 = " ".join(sorted(diff2to1))
+
+    combined_1to2 = (sorted_sect + " " + sorted_1to2).strip()
+    combined_2to1 = (sorted_sect + " " + sorted_2to1).strip()
+    sorted_sect = sorted_sect.strip()
+
+    return max(fuzz.partial_ratio(sorted_sect, combined_1to2),
+               fuzz.partial_ratio(sorted_sect, combined_2to1),
+               fuzz.partial_ratio(combined_1to2, combined_2to1))
+
+
+def match_answers(acceptable_answer, answers):
+    """
+    Compute the partial token set ratio of many answers against one acceptable answer.
+
+    The scores are exactly those of fuzz.partial_token_set_ratio(answer, acceptable_answer).
+    The acceptable answer is processed once, and answers that are identical, or that
+    have the same tokens once processed, are only matched once. Matching uses
+    python-Levenshtein when it is installed.
+
+    :param acceptable_answer: the answer to check against, as a string or a CompiledQuestion
+    :param answers: the answers provided by the applicants
+    :return: numpy.ndarray of int ratios, one per answer
+    """
+    if fuzz is None:
+        load_scoring_libraries()
+    if isinstance(acceptable_answer, CompiledQuestion):
+        acceptable_answer = acceptable_answer.answer
+
+    ratios = np.zeros(len(answers), dtype=np.int64)
+    if acceptable_answer is None:
+        return ratios
+
+    processed_acceptable_answer = utils.full_process(acceptable_answer, force_ascii=True)
+    if not utils.validate_string(processed_acceptable_answer):
+        return ratios
+    acceptable_tokens = set(processed_acceptable_answer.split())
+
+    ratios_by_answer = dict()
+    ratios_by_tokens = dict()
+
+    for index, answer in enumerate(answers):
+        ratio = ratios_by_answer.get(answer)
+
+        if ratio is None:
+            ratio = 0
+            processed_answer = utils.full_process(answer, force_ascii=True) if answer is not None else None
+            if utils.validate_string(processed_answer):
+                tokens = frozenset(processed_answer.split())
+                ratio = ratios_by_tokens.get(tokens)
+                if ratio is None:
+                    ratio = ratios_by_tokens[tokens] = _partial_token_set_ratio(set(tokens), acceptable_tokens)
+            ratios_by_answer[answer] = ratio
+
+        ratios[index] = ratio
+
+    return ratios
+
+
 def _answer_in_response(applicant_answer, acceptable_answer):
     """
     Determine if the entire acceptable answer is contained in the applicant's answer.
     
     :param str applicant_answer: the answer provided by the applicant
-    :param str acceptable_answer: the answer to check against
+    :param acceptable_answer: the answer to check against, as a string or a CompiledQuestion
     :return: boolean result: 100 if all parts are found in the response otherwise 0
     """
     # Determine if the acceptable answer parts are in the given answer
-    acceptable_answer_parts = [x.lower() for x in acceptable_answer.split(" ")]
-    answer_parts = [x.lower() for x in applicant_answer.split(" ")]
+    if isinstance(acceptable_answer, CompiledQuestion):
+        acceptable_answer_tokens = acceptable_answer.answer_tokens
+    else:
+        acceptable_answer_tokens = _answer_tokens(acceptable_answer)
+
+    # Stops at the first part that isn't found
+    if acceptable_answer_tokens.issubset(_answer_tokens(applicant_answer)):
+        return 100
+    else:
+        return 0
 
-    answer_parts_found = list()
 
-    for part in acceptable_answer_parts:
-        if part in answer_parts:
-            answer_parts_found.append("F")
-        else:
-            answer_parts_found.append("NF")
+def _explain_response(ja_response, rule):
+    """
+    Add the full fuzzy ratio breakdown to an applicant's answer.
 
-    if "NF" in answer_parts_found:
-        return 0
+    :param dict ja_response: the applicant's answer to a question
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :return: bool True if the answer passes
+    """
+    # Create the fuzzy ratios and add them to the applicant's answer
+    ja_response['fuzzy_ratios'] = _create_fuzzy_matches(ja_response['answer'], rule.answer)
+
+    # Determine if the acceptable answer is in the answer provided
+    ja_response['answer_in_response'] = _answer_in_response(applicant_answer=ja_response['answer'],
+                                                            acceptable_answer=rule)
+
+    return rule.accepts_any or ja_response['fuzzy_ratios']['partial_token_set_ratio'] >= PASSING_RATIO
+
+
+def _decide_response(ja_response, rule):
+    """
+    Compute only the fuzzy ratio the accept/reject decision needs.
+
+    :param dict ja_response: the applicant's answer to a question
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :return: bool True if the answer passes
+    """
+    if rule.accepts_any:
+        return True
+    if fuzz is None:
+        load_scoring_libraries()
+
+    ratio = fuzz.partial_token_set_ratio(ja_response['answer'], rule.answer)
+    ja_response['fuzzy_ratios'] = {"partial_token_set_ratio": ratio}
+
+    return ratio >= PASSING_RATIO
+
+
+def _cache_key(ja_response, rule, mode):
+    """
+    Create the verdict cache key of an applicant's answer.
+
+    Decision mode only uses partial_token_set_ratio, which fully processes its input,
+    so answers are keyed in their processed form. Full mode also computes case
+    sensitive ratios, so answers are keyed as given.
+
+    :param dict ja_response: the applicant's answer to a question
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :param str mode: the scoring mode
+    :return: tuple (question id, rule version, scoring mode, normalized answer)
+    """
+    if mode == DECISION_SCORING:
+        if fuzz is None:
+            load_scoring_libraries()
+        answer = utils.full_process(ja_response['answer'], force_ascii=True)
     else:
-        return 100
+        answer = ja_response['answer']
 
+    return (rule.id, rule.version, mode, answer)
 
-def score_job_application(application_questions, job_application):
+
+def _timed_score(score, ja_response, rule):
+    started = time.perf_counter()
+    passed = score(ja_response, rule)
+    jmet.stage_duration.observe(time.perf_counter() - started, 'scoring.fuzzy_match')
+    return passed
+
+
+def _score_response(ja_response, rule, mode, cache):
+    """
+    Score an applicant's answer, using the verdict cache when one is given.
+
+    :param dict ja_response: the applicant's answer to a question
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :param str mode: the scoring mode
+    :param VerdictCache cache: cache of scored answers, or None
+    :return: bool True if the answer passes
+    """
+    score = _decide_response if mode == DECISION_SCORING else _explain_response
+
+    if cache is None:
+        return _timed_score(score, ja_response, rule)
+
+    key = _cache_key(ja_response, rule, mode)
+    entry = cache.get(key)
+
+    if entry is None:
+        passed = _timed_score(score, ja_response, rule)
+        fields = dict((k, ja_response[k]) for k in ('fuzzy_ratios', 'answer_in_response') if k in ja_response)
+        cache.put(key, (fields, passed))
+        return passed
+
+    return _apply_cached(ja_response, entry)
+
+
+def _apply_cached(ja_response, entry):
+    fields, passed = entry
+    for k, v in fields.items():
+        ja_response[k] = dict(v) if isinstance(v, dict) else v
+
+    return passed
+
+
+def score_answer(rule, answer, mode=FULL_SCORING, cache=None):
+    """
+    Score a single answer to a question.
+
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :param str answer: the answer provided by the applicant
+    :param str mode: the scoring mode, one of SCORING_MODES
+    :param VerdictCache cache: cache of scored answers, or None
+    :return: dict the scored answer, including its verdict
+    """
+    ja_response = {'id': rule.id, 'answer': answer}
+    ja_response['passed'] = _score_response(ja_response, rule, mode, cache)
+    return ja_response
+
+
+def score_answers(rule, answers, mode=FULL_SCORING, cache=None):
+    """
+    Score many answers to the same question.
+
+    In decision mode the answers that aren't cached are matched together with
+    match_answers. The results are the same as calling score_answer for each answer.
+
+    :param CompiledQuestion rule: the compiled acceptable answer of the question
+    :param list answers: the answers provided by the applicants
+    :param str mode: the scoring mode, one of SCORING_MODES
+    :param VerdictCache cache: cache of scored answers, or None
+    :return: list of dicts, the scored answers in the order given
+    """
+    if mode != DECISION_SCORING or rule.accepts_any:
+        return [score_answer(rule, answer, mode, cache) for answer in answers]
+
+    scored_responses = [{'id': rule.id, 'answer': answer} for answer in answers]
+    unscored_responses = list()
+
+    for ja_response in scored_responses:
+        entry = cache.get(_cache_key(ja_response, rule, mode)) if cache is not None else None
+        if entry is None:
+            unscored_responses.append(ja_response)
+        else:
+            ja_response['passed'] = _apply_cached(ja_response, entry)
+
+    started = time.perf_counter()
+    ratios = match_answers(rule, [ja_response['answer'] for ja_response in unscored_responses])
+    jmet.stage_duration.observe(time.perf_counter() - started, 'scoring.batch_match')
+
+    for ja_response, ratio in zip(unscored_responses, ratios.tolist()):
+        ja_response['fuzzy_ratios'] = {"partial_token_set_ratio": ratio}
+        ja_response['passed'] = ratio >= PASSING_RATIO
+        if cache is not None:
+            cache.put(_cache_key(ja_response, rule, mode),
+                      ({'fuzzy_ratios': dict(ja_response['fuzzy_ratios'])}, ja_response['passed']))
+
+    return scored_responses
+
+
+def _prefetch_verdicts(application_questions, job_applications, mode, cache):
+    """
+    Score the distinct answers of many job applications question by question with score_answers.
+
+    Scoring the job applications afterwards finds every answer in the cache. Nothing is
+    prefetched when the cache can't hold all the answers.
+
+    :param QualificationSet application_questions: the compiled acceptable answers
+    :param list job_applications: the job applications about to be scored
+    :param str mode: the scoring mode
+    :param VerdictCache cache: cache of scored answers, or None
+    """
+    answers_by_question = dict()
+    for job_application in job_applications:
+        for ja_response in job_application.get('applicant_responses') or ():
+            if ja_response.get('id') in application_questions and isinstance(ja_response.get('answer'), str):
+                answers_by_question.setdefault(ja_response['id'], set()).add(ja_response['answer'])
+
+    if cache is None or sum(len(answers) for answers in answers_by_question.values()) > cache.maxsize:
+        return
+
+    for question_id, answers in answers_by_question.items():
+        score_answers(application_questions[question_id], list(answers), mode, cache)
+
+
+def score_job_application(application_questions, job_application, mode=FULL_SCORING, cache=None):
     """
     Score a job application.
-    
-    :param application_questions: questions and their answers
+
+    In full mode every answer gets the complete fuzzy ratio breakdown. In decision
+    mode only the ratio the decision needs is computed, and scoring stops at the
+    first failing answer; both modes reach the same decision.
+
+    :param application_questions: a QualificationSet, or a dict of question ids and their answers
     :param job_application: job application data
-    :return: dict job application with scores and an accept/reject decision
+    :param str mode: the scoring mode, one of SCORING_MODES
+    :param VerdictCache cache: cache of scored answers, or None to score every answer
+    :return: dict job application with scores, an accept/reject decision and the rule version used
     """
     # For each answer in the job application
     #   Get the approved answer, produce a score and the determine a final pass/fail
     # Return all scores and the final pass/fail to the calling method
 
-    scored_app = deepcopy(job_application)
+    if mode not in SCORING_MODES:
+        raise ValueError("Unknown scoring mode {}".format(mode))
 
-    pass_fails = list()
+    if not isinstance(application_questions, QualificationSet):
+        application_questions = QualificationSet(application_questions)
 
-    for ja_response in scored_app['applicant_responses']:
-        # Look up the answer in the application questions
-        acceptable_answer = application_questions[ja_response['id']]
+    started = time.perf_counter()
+    scored_app = deepcopy(job_application)
+    copied = time.perf_counter()
 
-        # Create the fuzzy ratios and add them to the applicant's answer
-        ja_response['fuzzy_ratios'] = _create_fuzzy_matches(ja_response['answer'], acceptable_answer)
+    # Look up the compiled rules up front so unknown questions fail the same way in both modes
+    rules = [application_questions[ja_response['id']] for ja_response in scored_app['applicant_responses']]
 
-        # Determine if the acceptable answer is in the answer provided
-        ja_response['answer_in_response'] = _answer_in_response(applicant_answer=ja_response['answer'],
-                                                                acceptable_answer=acceptable_answer)
+    scored_app['accepted'] = True
+    looked_up = time.perf_counter()
 
-        # Determine if this answer passes or fails
-        if acceptable_answer.lower() == "any":
-            pass_fails.append("P")
-        elif ja_response['fuzzy_ratios']['partial_token_set_ratio'] >= 80:
-            pass_fails.append("P")
-        else:
-            pass_fails.append("F")
+    for ja_response, rule in zip(scored_app['applicant_responses'], rules):
+        ja_response['passed'] = _score_response(ja_response, rule, mode, cache)
+        if not ja_response['passed']:
+            scored_app['accepted'] = False
+            if mode == DECISION_SCORING:
+                break
 
-    if "F" in pass_fails:
-        scored_app['accepted'] = False
-    else:
-        scored_app['accepted'] = True
+    scored_app['rule_version'] = application_questions.version
+
+    finished = time.perf_counter()
+    jmet.stage_duration.observe(copied - started, 'scoring.copy')
+    jmet.stage_duration.observe(looked_up - copied, 'scoring.rules')
+    jmet.stage_duration.observe(finished - looked_up, 'scoring.answers')
+    jmet.stage_duration.observe(finished - started, 'scoring.total')
 
     return scored_app
+
+
+def explain_job_application(application_questions, job_application):
+    """
+    Compute the full fuzzy ratio breakdown of every answer in a job application.
+
+    :param application_questions: a QualificationSet, or a dict of question ids and their answers
+    :param job_application: job application data
+    :return: dict job application with the full breakdown for every answer to a known question
+    """
+    if not isinstance(application_questions, QualificationSet):
+        application_questions = QualificationSet(application_questions)
+
+    explained_app = deepcopy(job_application)
+
+    for ja_response in explained_app['applicant_responses']:
+        if ja_response['id'] in application_questions:
+            _explain_response(ja_response, application_questions[ja_response['id']])
+
+    return explained_app
+
+
+def score_job_applications(application_questions, job_applications, mode=FULL_SCORING, rule_sets=None, cache=None):
+    """
+    Score a chunk of job applications.
+
+    Module level so it can be handed to a process pool. Each process uses its own
+    verdict cache. In decision mode the distinct answers of the chunk are first
+    matched question by question with the batch matcher.
+
+    :param application_questions: a QualificationSet, or a dict of question ids and their answers
+    :param list job_applications: the job applications to score
+    :param str mode: the scoring mode, one of SCORING_MODES
+    :param dict rule_sets: job posting ids and the subsets of application_questions that
+                           applications naming them are scored against
+    :param VerdictCache cache: cache of scored answers, None for the verdict_cache of this process
+    :return: list of (scored job application, error message) tuples, one per job application
+    """
+    if not isinstance(application_questions, QualificationSet):
+        application_questions = QualificationSet(application_questions)
+    rule_sets = rule_sets or dict()
+    cache = verdict_cache if cache is None else cache
+
+    if mode == DECISION_SCORING:
+        _prefetch_verdicts(application_questions, job_applications, mode, cache)
+
+    results = list()
+
+    for job_application in job_applications:
+        job_posting_id = job_application.get('job_posting_id')
+        rule_set = application_questions if job_posting_id is None else rule_sets.get(job_posting_id)
+
+        if rule_set is None:
+            results.append((None, "Unknown job posting {}".format(job_posting_id)))
+            continue
+
+        try:
+            results.append((score_job_application(rule_set, job_application, mode, cache), None))
+        except KeyError as e:
+            results.append((None, "Unknown question {}".format(e)))
+
+    return results
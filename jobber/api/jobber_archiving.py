@@ -0,0 +1,229 @@
+"""
+jobber.api.jobber_archiving
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Background archiving of rejected and aged job applications out of the job_applications table.
+
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+import jobber_orm as jorm
+
+
+class Archiver(object):
+    """
+    Moves, in batches, the job applications that are no longer read in listings into
+    the compressed archived_job_applications table.
+
+    Rejected job applications are archived once they were not updated for
+    rejected_after seconds, accepted ones after accepted_after seconds. Keeping only
+    the recent job applications in job_applications and applicant_responses keeps
+    those tables and their indexes small enough to stay cached. Archived job
+    applications are no longer counted in the question statistics or re-scored, so
+    archiving is off unless one of the two is set.
+    """
+
+    def __init__(self, db_session, rejected_after=0, accepted_after=0, batch_size=500, batch_pause=0.05,
+                 interval=3600.0, search_index=None):
+        """
+        :param db_session: the scoped database session
+        :param int rejected_after: seconds after their last update rejected job applications are archived, 0 to keep them
+        :param int accepted_after: seconds after their last update accepted job applications are archived, 0 to keep them
+        :param int batch_size: job applications archived per transaction
+        :param float batch_pause: seconds to yield to other traffic between batches
+        :param float interval: seconds between archiving runs
+        :param jobber_search.SearchIndex search_index: full-text index to remove archived job applications from, or None
+        """
+        self.db_session = db_session
+        self.search_index = search_index
+        self.rejected_after = rejected_after
+        self.accepted_after = accepted_after
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.last_run_at = None
+        self.last_run_archived = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.rejected_after > 0 or self.accepted_after > 0
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        if not self.enabled:
+            return
+
+        self._stopping.clear()
+        name = '{}-{}-archiving'.format(socket.gethostname(), os.getpid())
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread once it finishes its current batch.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except SQLAlchemyError:
+                # Typically another API worker archiving the same batch, the next run catches up
+                logging.exception("Archiving failed")
+                self.db_session.rollback()
+            finally:
+                self.db_session.remove()
+
+            self._stopping.wait(self.interval)
+
+    def run_once(self):
+        """
+        Archive batches until no archivable job applications are left.
+
+        :return: the number of job applications archived
+        :rtype: int
+        """
+        archived = 0
+        while not self._stopping.is_set():
+            batch = self.archive_batch()
+            archived += batch
+            if batch < self.batch_size:
+                break
+            self._stopping.wait(self.batch_pause)
+
+        if archived:
+            self.compact()
+            logging.info("Archived {} job applications".format(archived))
+
+        self.last_run_at = datetime.datetime.utcnow()
+        self.last_run_archived = archived
+
+        return archived
+
+    def _archivable(self, now):
+        conditions = list()
+        if self.rejected_after > 0:
+            rejected_before = now - datetime.timedelta(seconds=self.rejected_after)
+            conditions.append((jorm.JobApplication.accepted == False) &  # noqa: E712
+                              (jorm.JobApplication.updated_at < rejected_before))
+        if self.accepted_after > 0:
+            accepted_before = now - datetime.timedelta(seconds=self.accepted_after)
+            conditions.append((jorm.JobApplication.accepted == True) &  # noqa: E712
+                              (jorm.JobApplication.updated_at < accepted_before))
+
+        archivable = conditions[0]
+        for condition in conditions[1:]:
+            archivable = archivable | condition
+
+        # Applications whose responses were never moved out of the JSON blob are left to the migration
+        return archivable & jorm.JobApplication.legacy_responses.is_(None)
+
+    def archive_batch(self):
+        """
+        Archive the next batch of job applications in a single transaction.
+
+        :return: the number of job applications archived
+        :rtype: int
+        """
+        if not self.enabled:
+            return 0
+
+        now = datetime.datetime.utcnow()
+        columns = ('id', 'name') + jorm.ArchivedJobApplication.summary_columns[1:]
+
+        rows = self.db_session.query(*[getattr(jorm.JobApplication, column) for column in columns])\
+            .filter(self._archivable(now))\
+            .order_by(jorm.JobApplication.updated_at)\
+            .limit(self.batch_size).all()
+
+        if not rows:
+            self.db_session.rollback()
+            return 0
+
+        job_applications = [dict(zip(columns, row)) for row in rows]
+        job_application_ids = [job_application['id'] for job_application in job_applications]
+
+        responses = dict((job_application_id, list()) for job_application_id in job_application_ids)
+        response_columns = [getattr(jorm.ApplicantResponse, column) for column in jorm.ApplicantResponse.dump_columns]
+        for row in self.db_session.query(jorm.ApplicantResponse.job_application_id, *response_columns)\
+                .filter(jorm.ApplicantResponse.job_application_id.in_(job_application_ids))\
+                .order_by(jorm.ApplicantResponse.job_application_id, jorm.ApplicantResponse.position):
+            responses[row[0]].append(jorm.ApplicantResponse.dump_row(*row[1:]))
+
+        # Replaces the archive of an earlier job application with the same id
+        self.db_session.query(jorm.ArchivedJobApplication)\
+            .filter(jorm.ArchivedJobApplication.id.in_(job_application_ids))\
+            .delete(synchronize_session=False)
+
+        for job_application in job_applications:
+            name = job_application.pop('name')
+            self.db_session.add(jorm.ArchivedJobApplication(
+                archived_at=now,
+                data={'name': name, 'applicant_responses': responses[job_application['id']]},
+                **job_application))
+
+        self.db_session.query(jorm.ApplicantResponse)\
+            .filter(jorm.ApplicantResponse.job_application_id.in_(job_application_ids))\
+            .delete(synchronize_session=False)
+        self.db_session.query(jorm.JobApplication)\
+            .filter(jorm.JobApplication.id.in_(job_application_ids))\
+            .delete(synchronize_session=False)
+        if self.search_index is not None:
+            self.search_index.update(self.db_session, job_application_ids)
+        jorm.bump_table_version(self.db_session, 'job_applications')
+        self.db_session.commit()
+
+        return len(job_application_ids)
+
+    def compact(self):
+        """
+        Refresh the query planner statistics after many rows were moved, on SQLite.
+        """
+        bind = self.db_session.get_bind()
+        if bind.dialect.name == 'sqlite':
+            with bind.connect() as connection:
+                connection.execute('PRAGMA optimize')
+
+    def get(self, job_application_id):
+        """
+        Get an archived job application.
+
+        :param str job_application_id: ID of the job application
+        :return: the dumped job application, or None if it is not archived
+        :rtype: dict
+        """
+        archived = self.db_session.query(jorm.ArchivedJobApplication)\
+            .filter(jorm.ArchivedJobApplication.id == job_application_id).one_or_none()
+
+        return archived.dump() if archived is not None else None
+
+    def stats(self):
+        """
+        :return: dict the number and compressed size of the archived job applications, and the last run
+        """
+        archived = dict(self.db_session.query(jorm.ArchivedJobApplication.accepted,
+                                              func.count(jorm.ArchivedJobApplication.id))
+                        .group_by(jorm.ArchivedJobApplication.accepted))
+        compressed_bytes = self.db_session.query(func.sum(func.length(jorm.ArchivedJobApplication.data))).scalar()
+
+        return {
+            'accepted': archived.get(True, 0),
+            'rejected': archived.get(False, 0),
+            'compressed_bytes': compressed_bytes or 0,
+            'last_run_at': self.last_run_at,
+            'last_run_archived': self.last_run_archived
+        }
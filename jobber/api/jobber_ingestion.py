@@ -0,0 +1,239 @@
+"""
+jobber.api.jobber_ingestion
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Durable queue of submitted job applications, drained by background scoring workers.
+
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+from sqlalchemy import func
+import jobber_orm as jorm
+import jobber_api_utils as jau
+
+
+class IngestionQueue(object):
+    """
+    Job applications stored in the ingestion_queue table until a worker scores and saves them.
+
+    Workers claim items with a conditional update, so several threads or processes can
+    drain the same queue. Items whose worker died are reclaimed once their lease expires.
+    """
+
+    def __init__(self, db_session, score_batch, workers=2, batch_size=100, poll_interval=0.5, lease_seconds=60):
+        """
+        :param db_session: the scoped database session
+        :param score_batch: function scoring a list of job applications, see jau.score_job_applications
+        :param int workers: number of worker threads
+        :param int batch_size: maximum number of job applications scored and saved per transaction
+        :param float poll_interval: seconds an idle worker waits before checking the queue again
+        :param int lease_seconds: seconds after which an unfinished claimed item is handed to another worker
+        """
+        self.db_session = db_session
+        self.score_batch = score_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads = list()
+
+    def enqueue(self, job_application):
+        """
+        Add a job application to the queue as part of the current transaction.
+
+        :param dict job_application: the job application, including its id
+        """
+        self.db_session.add(jorm.IngestionQueueItem(job_application_id=job_application['id'],
+                                                    job_application=job_application,
+                                                    content_hash=job_application.get('content_hash'),
+                                                    status=jorm.IngestionQueueItem.PENDING,
+                                                    enqueued_at=datetime.datetime.utcnow()))
+
+    def notify(self):
+        """
+        Wake an idle worker after new items were committed.
+        """
+        self._wakeup.set()
+
+    def find(self, job_application_id):
+        """
+        Get the most recent queue item of a job application.
+
+        :param str job_application_id: id of the job application
+        :return: the queue item, or None if the job application is not queued
+        :rtype: jorm.IngestionQueueItem
+        """
+        return self.db_session.query(jorm.IngestionQueueItem)\
+            .filter(jorm.IngestionQueueItem.job_application_id == job_application_id)\
+            .order_by(jorm.IngestionQueueItem.id.desc()).first()
+
+    def stats(self):
+        """
+        Get the depth and lag of the queue.
+
+        :return: dict of pending, processing and failed item counts and the age of the oldest pending item
+        """
+        counts = dict(self.db_session.query(jorm.IngestionQueueItem.status, func.count())
+                      .group_by(jorm.IngestionQueueItem.status))
+        oldest = self.db_session.query(func.min(jorm.IngestionQueueItem.enqueued_at))\
+            .filter(jorm.IngestionQueueItem.status == jorm.IngestionQueueItem.PENDING).scalar()
+
+        return {
+            'pending': counts.get(jorm.IngestionQueueItem.PENDING, 0),
+            'processing': counts.get(jorm.IngestionQueueItem.PROCESSING, 0),
+            'failed': counts.get(jorm.IngestionQueueItem.FAILED, 0),
+            'lag_seconds': (datetime.datetime.utcnow() - oldest).total_seconds() if oldest is not None else 0.0,
+            'workers': len(self._threads)
+        }
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        self._stopping.clear()
+        for number in range(self.workers):
+            name = '{}-{}-ingestion-{}'.format(socket.gethostname(), os.getpid(), number)
+            thread = threading.Thread(target=self._run, args=(name,), name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        logging.info("Started {} ingestion workers".format(self.workers))
+
+    def stop(self):
+        """
+        Stop the worker threads once they finish their current batch.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+
+    def _run(self, worker_name):
+        while not self._stopping.is_set():
+            try:
+                processed = self.process_batch(worker_name)
+            except Exception:
+                # Whatever went wrong, the worker keeps draining the queue; the claimed items are retried
+                # once their lease expires
+                logging.exception("Ingestion worker {} failed".format(worker_name))
+                self.db_session.rollback()
+                processed = 0
+            finally:
+                self.db_session.remove()
+
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self, worker_name):
+        """
+        Claim the oldest pending items, and items whose lease expired.
+
+        :param str worker_name: unique name of the claiming worker
+        :return: the claimed items
+        :rtype: list
+        """
+        now = datetime.datetime.utcnow()
+        lease_expiry = now - datetime.timedelta(seconds=self.lease_seconds)
+        claimable = (jorm.IngestionQueueItem.status == jorm.IngestionQueueItem.PENDING) | \
+                    ((jorm.IngestionQueueItem.status == jorm.IngestionQueueItem.PROCESSING) &
+                     (jorm.IngestionQueueItem.claimed_at < lease_expiry))
+
+        item_ids = [item_id for item_id, in self.db_session.query(jorm.IngestionQueueItem.id)
+                    .filter(claimable).order_by(jorm.IngestionQueueItem.id).limit(self.batch_size)]
+        if not item_ids:
+            self.db_session.rollback()
+            return list()
+
+        # Only items still claimable are taken, another worker may have claimed some of them meanwhile
+        self.db_session.query(jorm.IngestionQueueItem)\
+            .filter(jorm.IngestionQueueItem.id.in_(item_ids), claimable)\
+            .update({jorm.IngestionQueueItem.status: jorm.IngestionQueueItem.PROCESSING,
+                     jorm.IngestionQueueItem.worker: worker_name,
+                     jorm.IngestionQueueItem.claimed_at: now},
+                    synchronize_session=False)
+        self.db_session.commit()
+
+        return self.db_session.query(jorm.IngestionQueueItem)\
+            .filter(jorm.IngestionQueueItem.id.in_(item_ids),
+                    jorm.IngestionQueueItem.worker == worker_name,
+                    jorm.IngestionQueueItem.claimed_at == now)\
+            .order_by(jorm.IngestionQueueItem.id).all()
+
+    def process_batch(self, worker_name):
+        """
+        Claim, score and save one batch of queued job applications in a single transaction.
+
+        Saved job applications are removed from the queue, ones that could not be saved
+        stay in it as failed.
+
+        :param str worker_name: unique name of the worker
+        :return: int number of queue items processed
+        """
+        items = self._claim(worker_name)
+        if not items:
+            return 0
+
+        job_application_ids = [item.job_application_id for item in items]
+        existing_ids = set(row.id for row in self.db_session.query(jorm.JobApplication.id)
+                           .filter(jorm.JobApplication.id.in_(job_application_ids)))
+
+        scored_batch = self._score(items)
+        now = datetime.datetime.utcnow()
+        saved = 0
+
+        for item, (scored_application, error) in zip(items, scored_batch):
+            if item.job_application_id in existing_ids:
+                item.status = jorm.IngestionQueueItem.FAILED
+                item.error = 'Already exists'
+            elif error is not None:
+                item.status = jorm.IngestionQueueItem.FAILED
+                item.error = error[:255]
+            else:
+                existing_ids.add(item.job_application_id)
+                scored_application['created_at'] = item.enqueued_at
+                scored_application['updated_at'] = now
+                self.db_session.add(jorm.JobApplication(**scored_application))
+                self.db_session.delete(item)
+                saved += 1
+
+        if saved:
+            jorm.bump_table_version(self.db_session, 'job_applications')
+        self.db_session.commit()
+
+        logging.info("Ingestion worker {} saved {} of {} job applications".format(worker_name, saved, len(items)))
+
+        return len(items)
+
+    def _score(self, items):
+        """
+        Score the job applications of queue items, failing the items that can't be scored one by one.
+
+        :param list items: the claimed queue items
+        :return: list of (scored job application, error message) tuples, one per item
+        """
+        errors = [jau.validate_job_application(item.job_application) for item in items]
+        valid_applications = [item.job_application for item, error in zip(items, errors) if error is None]
+
+        try:
+            scored = iter(self.score_batch(valid_applications))
+        except Exception:
+            logging.exception("Could not score a batch of {} queued job applications, scoring them one by one"
+                              .format(len(valid_applications)))
+            scored = iter([self._score_one(job_application) for job_application in valid_applications])
+
+        return [next(scored) if error is None else (None, error) for error in errors]
+
+    def _score_one(self, job_application):
+        try:
+            return self.score_batch([job_application])[0]
+        except Exception as e:
+            logging.exception("Could not score queued job application {}".format(job_application.get('id')))
+            return None, "Could not be scored: {}: {}".format(type(e).__name__, e)
@@ -0,0 +1,317 @@
+"""
+jobber.api.jobber_metrics
+~~~~~~~~~~~~~~~~~~~~~~~~~
+In-process metrics rendered in the Prometheus text format, and an optional sampling profiler.
+
+"""
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Counter
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_VERBS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    """
+    Monotonically increasing count, per combination of label values.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        for labels, value in values:
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(value)))
+        return lines
+
+
+class Histogram(object):
+    """
+    Distribution of observed values in cumulative buckets, per combination of label values.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """
+        Record an observation.
+
+        :param float value: the observed value, for durations in seconds
+        :param labels: the label values, in the order of the label names
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        """
+        Time a block of code.
+
+        :param labels: the label values, in the order of the label names
+        :return: context manager observing the duration of the block
+        """
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count)
+                            in self._values.items())
+
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labelnames, labels, ('le', _format_value(bound))), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labelnames, labels), repr(total)))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labelnames, labels), count))
+        return lines
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class CallbackMetric(object):
+    """
+    Counter or gauge whose values are read from a function when the metrics are rendered.
+    """
+
+    def __init__(self, name, documentation, callback, metric_type='gauge', labelnames=()):
+        """
+        :param str name: name of the metric
+        :param str documentation: help text of the metric
+        :param callback: function returning a number, or a dict of label value tuples and numbers
+        :param str metric_type: 'gauge' or 'counter'
+        :param tuple labelnames: the label names, if the callback returns a dict
+        """
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for labels, value in sorted(values.items()):
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(value)))
+        return lines
+
+
+class Registry(object):
+    """
+    Collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics = list()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :return: str the metrics
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'jobber_request_duration_seconds', 'Time spent handling API requests, including encoding the response.',
+    ('operation', 'method', 'status')))
+stage_duration = registry.register(Histogram(
+    'jobber_stage_duration_seconds', 'Time spent in stages of scoring and persisting job applications.',
+    ('stage',)))
+sql_duration = registry.register(Histogram(
+    'jobber_sql_statement_duration_seconds', 'Time spent executing SQL statements.',
+    ('statement',)))
+sql_statements = registry.register(Counter(
+    'jobber_sql_statements_total', 'SQL statements executed.',
+    ('statement',)))
+admission_queue_wait = registry.register(Histogram(
+    'jobber_admission_queue_wait_seconds', 'Time requests waited for their turn to be handled.',
+    ('class',)))
+admission_rejected = registry.register(Counter(
+    'jobber_admission_rejected_total', 'Requests turned away with 429 Too Many Requests.',
+    ('class', 'reason')))
+
+
+def instrument_engine(engine):
+    """
+    Count and time the SQL statements an engine executes.
+
+    :param engine: the SQLAlchemy engine
+    """
+    # A connection runs one statement at a time. A failed statement skips after_cursor_execute, and the
+    # next statement replaces its start time
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['jobber_statement_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('jobber_statement_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        verb = statement.lstrip()[:6].upper()
+        if verb not in SQL_VERBS:
+            verb = 'OTHER'
+        sql_statements.inc(verb)
+        sql_duration.observe(duration, verb)
+
+
+def instrument_session(db_session):
+    """
+    Time the commits, including the final flush, of a session.
+
+    :param db_session: the scoped database session
+    """
+    @event.listens_for(db_session, 'before_commit')
+    def before_commit(session):
+        session.info['jobber_commit_started'] = time.perf_counter()
+
+    @event.listens_for(db_session, 'after_commit')
+    def after_commit(session):
+        started = session.info.pop('jobber_commit_started', None)
+        if started is not None:
+            stage_duration.observe(time.perf_counter() - started, 'db.commit')
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all other threads at a fixed interval.
+
+    The samples are aggregated as collapsed stacks, the input format of flame graph tools.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        """
+        :param float interval: seconds between samples
+        :param int max_depth: innermost frames kept of each stack
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = _Counter()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            stacks = list()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = list()
+                while frame is not None and len(frames) < self.max_depth:
+                    code = frame.f_code
+                    frames.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(frames)))
+
+            with self._lock:
+                self.samples.update(stacks)
+
+    def collapsed(self, reset=False):
+        """
+        Get the samples taken so far.
+
+        :param bool reset: discard the samples after reading them
+        :return: str one "frame;frame;frame count" line per distinct stack
+        """
+        with self._lock:
+            samples = self.samples.copy()
+            if reset:
+                self.samples.clear()
+
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in samples.most_common())
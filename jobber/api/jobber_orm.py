@@ -1,8 +1,12 @@
 import json
-from os import getenv
-from sqlalchemy import Boolean, Column, DateTime, String, TypeDecorator, create_engine
+import datetime
+import zlib
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, String, Text, \
+    TypeDecorator, create_engine, event, inspect, text
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 
 Base = declarative_base()
 
@@ -13,18 +17,47 @@ class Json(TypeDecorator):
     """
     impl = String
 
+    def load_dialect_impl(self, dialect):
+        # Unbounded on every database, SQLite never enforced the declared length
+        return dialect.type_descriptor(Text())
+
     def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
         return json.dumps(value)
 
     def process_result_value(self, value, dialect):
+        if value is None:
+            return None
         return json.loads(value)
 
 
+class CompressedJson(TypeDecorator):
+    """
+    CompressedJson class for storing json data compressed with zlib
+    """
+    impl = LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return json.loads(zlib.decompress(value).decode('utf-8'))
+
+
 class Question(Base):
     """
     Question class.
     """
     __tablename__ = 'questions'
+
+    # Columns dump() returns, for queries that skip building Question objects
+    dump_columns = ('id', 'question', 'answer', 'created_at', 'updated_at')
+
     id = Column(String(250), primary_key=True)
     question = Column(String(250))
     answer = Column(String(250))
@@ -47,45 +80,550 @@ class Question(Base):
         return dict([(k, v) for k, v in vars(self).items() if not k.startswith('_')])
 
 
+class JobPosting(Base):
+    """
+    JobPosting class.
+
+    A job that applications are submitted for, and the questions its applicants answer.
+    """
+    __tablename__ = 'job_postings'
+
+    # Columns dump() returns besides the question ids, for queries that skip building JobPosting objects
+    dump_columns = ('id', 'title', 'created_at', 'updated_at')
+
+    id = Column(String(250), primary_key=True)
+    title = Column(String(250))
+    created_at = Column(DateTime())
+    updated_at = Column(DateTime())
+
+    questions = relationship('JobPostingQuestion',
+                             order_by='JobPostingQuestion.position',
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
+
+    @property
+    def question_ids(self):
+        return [question.question_id for question in self.questions]
+
+    @question_ids.setter
+    def question_ids(self, question_ids):
+        self.questions = [JobPostingQuestion(position=position, question_id=question_id)
+                          for position, question_id in enumerate(question_ids)]
+
+    def update(self, id=None, title=None, question_ids=None, created_at=None, updated_at=None):
+        if id is not None:
+            self.id = id
+        if title is not None:
+            self.title = title
+        if question_ids is not None:
+            self.question_ids = question_ids
+        if created_at is not None:
+            self.created_at = created_at
+        if updated_at is not None:
+            self.updated_at = updated_at
+
+    def dump(self):
+        data = dict([(k, v) for k, v in vars(self).items() if not k.startswith('_') and k != 'questions'])
+        data['question_ids'] = self.question_ids
+        return data
+
+
+class JobPostingQuestion(Base):
+    """
+    JobPostingQuestion class.
+
+    A question of a job posting's question set.
+    """
+    __tablename__ = 'job_posting_questions'
+    __table_args__ = (
+        # Finds the postings that ask a question, e.g. when the question is deleted
+        Index('ix_job_posting_questions_question_id', 'question_id'),
+    )
+
+    job_posting_id = Column(String(250), ForeignKey('job_postings.id', ondelete='CASCADE'), primary_key=True)
+    question_id = Column(String(250), primary_key=True)
+    position = Column(Integer(), nullable=False)
+
+
 class JobApplication(Base):
     """
     JobApplication class.
     """
     __tablename__ = 'job_applications'
+    __table_args__ = (
+        # Serves the newest-first keyset pagination of accepted job applications
+        Index('ix_job_applications_accepted_created_at_id', 'accepted', 'created_at', 'id'),
+        # Serves incremental exports of the job applications updated since a watermark
+        Index('ix_job_applications_updated_at_id', 'updated_at', 'id'),
+        # Finds recent submissions of the same content, see jobber_api_utils.content_hash
+        Index('ix_job_applications_content_hash_created_at', 'content_hash', 'created_at'),
+        # Serves the keyset pagination of the accepted job applications of a job posting
+        Index('ix_job_applications_job_posting_id_accepted_created_at_id',
+              'job_posting_id', 'accepted', 'created_at', 'id'),
+    )
+
+    # Columns of the lightweight listing, without the applicant responses
+    summary_columns = ('id', 'job_posting_id', 'name', 'accepted', 'rule_version', 'created_at', 'updated_at')
+
     id = Column(String(250), primary_key=True)
+    # Null for applications scored against every question rather than a job posting's
+    job_posting_id = Column(String(250))
     name = Column(String(255))
-    applicant_responses = Column(Json(128))
+    # Responses of applications saved before they moved to the applicant_responses table,
+    # emptied by migrate_applicant_responses
+    legacy_responses = Column('applicant_responses', Json(128))
     accepted = Column(Boolean())
+    rule_version = Column(Integer())
+    content_hash = Column(String(64))
     created_at = Column(DateTime())
     updated_at = Column(DateTime())
 
-    def update(self, id=None, name=None, applicant_responses=None, accepted=None, created_at=None, updated_at=None):
+    responses = relationship('ApplicantResponse',
+                             order_by='ApplicantResponse.position',
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
+
+    @property
+    def applicant_responses(self):
+        return [response.dump() for response in self.responses]
+
+    @applicant_responses.setter
+    def applicant_responses(self, applicant_responses):
+        self.responses = [ApplicantResponse.from_dict(position, applicant_response)
+                          for position, applicant_response in enumerate(applicant_responses)]
+
+    def update(self, id=None, job_posting_id=None, name=None, applicant_responses=None, accepted=None,
+               rule_version=None, content_hash=None, created_at=None, updated_at=None):
         if id is not None:
             self.id = id
+        if job_posting_id is not None:
+            self.job_posting_id = job_posting_id
         if name is not None:
             self.name = name
         if applicant_responses is not None:
             self.applicant_responses = applicant_responses
         if accepted is not None:
             self.accepted = accepted
+        if rule_version is not None:
+            self.rule_version = rule_version
+        if content_hash is not None:
+            self.content_hash = content_hash
         if created_at is not None:
             self.created_at = created_at
         if updated_at is not None:
             self.updated_at = updated_at
 
+    def dump(self):
+        data = dict([(k, v) for k, v in vars(self).items()
+                     if not k.startswith('_') and k not in ('legacy_responses', 'responses', 'content_hash')])
+        data['applicant_responses'] = self.applicant_responses
+        return data
+
+
+class ApplicantResponse(Base):
+    """
+    ApplicantResponse class.
+
+    An applicant's answer to one question, along with its verdict.
+    """
+    __tablename__ = 'applicant_responses'
+    __table_args__ = (
+        Index('ix_applicant_responses_question_id_passed', 'question_id', 'passed'),
+        Index('ix_applicant_responses_question_id_answer', 'question_id', 'answer'),
+        Index('ix_applicant_responses_question_id_job_application_id', 'question_id', 'job_application_id'),
+    )
+
+    id = Column(Integer(), primary_key=True)
+    job_application_id = Column(String(250), ForeignKey('job_applications.id', ondelete='CASCADE'),
+                                nullable=False, index=True)
+    position = Column(Integer(), nullable=False)
+    question_id = Column(String(250), nullable=False)
+    answer = Column(String(255))
+    # Null when the answer was not scored, e.g. after an earlier answer failed in decision scoring mode
+    passed = Column(Boolean())
+    # The partial token set ratio the verdict is based on
+    ratio = Column(Integer())
+    answer_in_response = Column(Integer())
+    fuzzy_ratios = Column(Json())
+
+    @classmethod
+    def from_dict(cls, position, applicant_response):
+        """
+        Create a response from its API representation.
+
+        :param int position: position of the response in the job application
+        :param dict applicant_response: the response, as scored by score_job_application
+        :return: ApplicantResponse
+        """
+        fuzzy_ratios = applicant_response.get('fuzzy_ratios')
+        return cls(position=position,
+                   question_id=applicant_response['id'],
+                   answer=applicant_response['answer'],
+                   passed=applicant_response.get('passed'),
+                   ratio=fuzzy_ratios.get('partial_token_set_ratio') if fuzzy_ratios else None,
+                   answer_in_response=applicant_response.get('answer_in_response'),
+                   fuzzy_ratios=fuzzy_ratios)
+
+    # Columns dump_row() takes, for queries that skip building ApplicantResponse objects
+    dump_columns = ('question_id', 'answer', 'passed', 'fuzzy_ratios', 'answer_in_response')
+
+    def dump(self):
+        return self.dump_row(self.question_id, self.answer, self.passed, self.fuzzy_ratios, self.answer_in_response)
+
+    @staticmethod
+    def dump_row(question_id, answer, passed, fuzzy_ratios, answer_in_response):
+        data = {
+            'id': question_id,
+            'answer': answer,
+            'passed': passed
+        }
+        if fuzzy_ratios is not None:
+            data['fuzzy_ratios'] = fuzzy_ratios
+        if answer_in_response is not None:
+            data['answer_in_response'] = answer_in_response
+        return data
+
+
+class ArchivedJobApplication(Base):
+    """
+    ArchivedJobApplication class.
+
+    A job application moved out of the job_applications table by jobber_archiving.Archiver.
+    The name and applicant responses are kept as a single compressed document.
+    """
+    __tablename__ = 'archived_job_applications'
+
+    # Columns of the lightweight listing, kept as columns
+    summary_columns = ('id', 'job_posting_id', 'accepted', 'rule_version', 'created_at', 'updated_at')
+
+    id = Column(String(250), primary_key=True)
+    job_posting_id = Column(String(250))
+    accepted = Column(Boolean())
+    rule_version = Column(Integer())
+    created_at = Column(DateTime())
+    updated_at = Column(DateTime())
+    archived_at = Column(DateTime(), nullable=False, index=True)
+    # The name and the dumped applicant responses
+    data = Column(CompressedJson())
+
+    def dump(self):
+        data = dict((column, getattr(self, column)) for column in self.summary_columns)
+        data['name'] = self.data['name']
+        data['applicant_responses'] = self.data['applicant_responses']
+        data['archived_at'] = self.archived_at
+        return data
+
+
+class SearchDocument(Base):
+    """
+    SearchDocument class.
+
+    Links a job application to its row in the full-text search index, see jobber_search.SearchIndex.
+    """
+    __tablename__ = 'search_documents'
+
+    # The rowid of the job application's row in the job_applications_fts table
+    id = Column(Integer(), primary_key=True)
+    job_application_id = Column(String(250), nullable=False, unique=True)
+
+
+class IngestionQueueItem(Base):
+    """
+    IngestionQueueItem class.
+
+    A job application waiting to be scored by the background ingestion workers.
+    """
+    __tablename__ = 'ingestion_queue'
+    __table_args__ = (
+        Index('ix_ingestion_queue_status_id', 'status', 'id'),
+        Index('ix_ingestion_queue_content_hash_enqueued_at', 'content_hash', 'enqueued_at'),
+    )
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    FAILED = 'failed'
+
+    id = Column(Integer(), primary_key=True)
+    job_application_id = Column(String(250), nullable=False, index=True)
+    job_application = Column(Json(), nullable=False)
+    content_hash = Column(String(64))
+    status = Column(String(20), nullable=False, default=PENDING)
+    worker = Column(String(250))
+    error = Column(String(255))
+    enqueued_at = Column(DateTime())
+    claimed_at = Column(DateTime())
+
+    def dump(self):
+        return dict([(k, v) for k, v in vars(self).items() if not k.startswith('_')])
+
+
+class IdempotencyKey(Base):
+    """
+    IdempotencyKey class.
+
+    An Idempotency-Key sent with a job application, and the job application it created.
+    Repeating a request with the same key returns the first result instead of saving again.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(255), primary_key=True)
+    job_application_id = Column(String(250), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime(), nullable=False, index=True)
+
+    def dump(self):
+        return dict([(k, v) for k, v in vars(self).items() if not k.startswith('_')])
+
+
+class RescoreJob(Base):
+    """
+    RescoreJob class.
+
+    Re-evaluation of the stored job applications that answered a question whose
+    acceptable answer changed. Progress is saved after every chunk, so a job resumes
+    where it stopped.
+    """
+    __tablename__ = 'rescore_jobs'
+    __table_args__ = (
+        Index('ix_rescore_jobs_status_id', 'status', 'id'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    SUPERSEDED = 'superseded'
+
+    id = Column(Integer(), primary_key=True)
+    question_id = Column(String(250), nullable=False, index=True)
+    rule_version = Column(Integer(), nullable=False)
+    status = Column(String(20), nullable=False, default=PENDING)
+    # Id of the last job application re-scored
+    cursor = Column(String(250))
+    total = Column(Integer())
+    processed = Column(Integer(), nullable=False, default=0)
+    changed = Column(Integer(), nullable=False, default=0)
+    worker = Column(String(250))
+    claimed_at = Column(DateTime())
+    created_at = Column(DateTime())
+    updated_at = Column(DateTime())
+
     def dump(self):
         return dict([(k, v) for k, v in vars(self).items() if not k.startswith('_')])
 
 
-def init_db(uri):
+class TableVersion(Base):
+    """
+    TableVersion class.
+
+    Holds a counter per table that is bumped on every write, so cached
+    copies of the table can tell when they have gone stale.
+    """
+    __tablename__ = 'table_versions'
+    name = Column(String(250), primary_key=True)
+    version = Column(Integer(), nullable=False, default=0)
+    updated_at = Column(DateTime())
+
+    def dump(self):
+        return dict([(k, v) for k, v in vars(self).items() if not k.startswith('_')])
+
+
+def get_table_version(db_session, name):
+    """
+    Get the current version of a table.
+
+    :param db_session: the database session
+    :param str name: name of the table
+    :return: the table version, 0 if the table was never written to
+    :rtype: int
+    """
+    version = db_session.query(TableVersion.version).filter(TableVersion.name == name).scalar()
+    return version or 0
+
+
+def bump_table_version(db_session, name):
+    """
+    Increment the version of a table as part of the current transaction.
+
+    :param db_session: the database session
+    :param str name: name of the table
+    :return: the new table version
+    :rtype: int
+    """
+    now = datetime.datetime.utcnow()
+    updated = db_session.query(TableVersion).filter(TableVersion.name == name).update(
+        {TableVersion.version: TableVersion.version + 1, TableVersion.updated_at: now},
+        synchronize_session=False)
+
+    if not updated:
+        db_session.add(TableVersion(name=name, version=1, updated_at=now))
+        db_session.flush()
+
+    return get_table_version(db_session, name)
+
+
+def _upgrade_schema(engine):
+    """
+    Add the columns and indexes that were introduced after a database was created.
+
+    ``create_all`` only creates missing tables, so existing jobber.db files are
+    brought up to date here.
+    """
+    inspector = inspect(engine)
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = set(c['name'] for c in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'
+                                            .format(table.name, column.name, column_type)))
+
+            existing_indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=connection)
+
+
+def migrate_applicant_responses(db_session, batch_size=500):
+    """
+    Move the responses of job applications saved as a JSON blob into the applicant_responses table.
+
+    Accepted applications passed every answer. For rejected applications the verdict is
+    derived from the stored partial token set ratio and the questions' current answers.
+
+    :param db_session: the database session
+    :param int batch_size: job applications migrated per transaction
+    :return: int number of job applications migrated
+    """
+    any_questions = set(question_id for question_id, answer in db_session.query(Question.id, Question.answer)
+                        if answer is not None and answer.lower() == 'any')
+    migrated = 0
+
+    while True:
+        job_applications = db_session.query(JobApplication).filter(JobApplication.legacy_responses.isnot(None))\
+            .limit(batch_size).all()
+
+        if not job_applications:
+            return migrated
+
+        for job_application in job_applications:
+            applicant_responses = list()
+            for applicant_response in job_application.legacy_responses:
+                fuzzy_ratios = applicant_response.get('fuzzy_ratios') or dict()
+                if job_application.accepted or applicant_response['id'] in any_questions:
+                    applicant_response['passed'] = True
+                elif 'partial_token_set_ratio' in fuzzy_ratios:
+                    applicant_response['passed'] = fuzzy_ratios['partial_token_set_ratio'] >= 80
+                applicant_responses.append(applicant_response)
+
+            job_application.applicant_responses = applicant_responses
+            job_application.legacy_responses = None
+
+        db_session.commit()
+        migrated += len(job_applications)
+
+
+def is_in_memory(uri):
+    """
+    Determine if a database URL names an in-memory SQLite database.
+
+    Such a database lives in a single connection that every thread shares, see create_db_engine.
+
+    :param uri: SQLAlchemy database URL
+    :return: bool True for sqlite:// and sqlite:///:memory:
+    """
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _set_sqlite_pragmas(engine, journal_mode, synchronous, mmap_size, busy_timeout):
+    """
+    Tune every new SQLite connection of an engine.
+
+    In WAL mode readers don't block behind a writer, and a writer waits up to
+    busy_timeout milliseconds for another writer instead of failing at once.
+    Foreign keys are enforced, so deletes cascade to the rows that reference
+    the deleted ones, as they do on other databases.
+    """
+    in_memory = is_in_memory(engine.url)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        if journal_mode and not in_memory:
+            cursor.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        if synchronous:
+            cursor.execute('PRAGMA synchronous={}'.format(synchronous))
+        if mmap_size:
+            cursor.execute('PRAGMA mmap_size={:d}'.format(mmap_size))
+        if busy_timeout:
+            cursor.execute('PRAGMA busy_timeout={:d}'.format(busy_timeout))
+        cursor.close()
+
+
+def create_db_engine(uri, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=-1,
+                     journal_mode='WAL', synchronous='NORMAL', mmap_size=268435456, busy_timeout=5000):
+    """
+    Create the database engine.
+
+    :param str uri: SQLAlchemy database URL, e.g. sqlite:///data/jobber.db or postgresql://user@localhost/jobber
+    :param int pool_size: connections kept open in the pool
+    :param int max_overflow: connections opened beyond pool_size under load
+    :param int pool_timeout: seconds to wait for a pooled connection
+    :param int pool_recycle: seconds after which a pooled connection is replaced, -1 to keep them
+    :param str journal_mode: SQLite journal mode
+    :param str synchronous: SQLite synchronous setting
+    :param int mmap_size: bytes of a SQLite database read through memory-mapped I/O, 0 to disable
+    :param int busy_timeout: milliseconds a SQLite writer waits for the write lock
+    :return: the engine
+    """
+    url = make_url(uri)
+
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url,
+                             convert_unicode=True,
+                             pool_size=pool_size,
+                             max_overflow=max_overflow,
+                             pool_timeout=pool_timeout,
+                             pool_recycle=pool_recycle)
+
+    if is_in_memory(url):
+        # Every connection to :memory: is a separate database, so share a single one. Its transaction is
+        # shared too: a rollback in any thread discards the others' changes, so no background workers use it
+        engine = create_engine(url,
+                               convert_unicode=True,
+                               connect_args={'check_same_thread': False},
+                               poolclass=StaticPool)
+    else:
+        # Connections are returned to the pool by whichever thread used them last
+        engine = create_engine(url,
+                               convert_unicode=True,
+                               connect_args={'check_same_thread': False},
+                               poolclass=QueuePool,
+                               pool_size=pool_size,
+                               max_overflow=max_overflow,
+                               pool_timeout=pool_timeout,
+                               pool_recycle=pool_recycle)
+
+    _set_sqlite_pragmas(engine, journal_mode, synchronous, mmap_size, busy_timeout)
+
+    return engine
+
+
+def init_db(uri, **engine_options):
     """
     Initialize the database connection.
+
+    :param str uri: SQLAlchemy database URL
+    :param engine_options: pool and SQLite settings, see create_db_engine
+    :return: the scoped database session
     """
-    db_dir= getenv('DB_DIR', './data')
-    db_file_name = getenv('DB_FILE_NAME', 'jobber.db')
-    db_engine = 'sqlite:///{}/{}'.format(db_dir, db_file_name)
-    engine = create_engine(db_engine, convert_unicode=True)
+    engine = create_db_engine(uri, **engine_options)
     db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
     Base.query = db_session.query_property()
     Base.metadata.create_all(bind=engine)
-    return db_session
\ No newline at end of file
+    _upgrade_schema(engine)
+    migrate_applicant_responses(db_session)
+    return db_session
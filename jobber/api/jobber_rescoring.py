@@ -0,0 +1,266 @@
+"""
+jobber.api.jobber_rescoring
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Background re-scoring of stored job applications after a question's acceptable answer changes.
+
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+from sqlalchemy import func
+import jobber_orm as jorm
+import jobber_api_utils as jau
+
+
+class Rescorer(object):
+    """
+    Re-scores, in resumable chunks, only the answers to a changed question.
+
+    The stored verdicts of every other answer are reused to decide whether each
+    job application is still accepted.
+    """
+
+    def __init__(self, db_session, get_qualification_set, mode=jau.FULL_SCORING, cache=None,
+                 chunk_size=500, chunk_pause=0.05, poll_interval=1.0, lease_seconds=60):
+        """
+        :param db_session: the scoped database session
+        :param get_qualification_set: function returning the current QualificationSet
+        :param str mode: the scoring mode, one of jau.SCORING_MODES
+        :param jau.VerdictCache cache: cache of scored answers, or None
+        :param int chunk_size: answers to the changed question re-scored per transaction
+        :param float chunk_pause: seconds to yield to other traffic between chunks
+        :param float poll_interval: seconds the idle worker waits before looking for new jobs
+        :param int lease_seconds: seconds after which a job whose worker stopped is resumed by another worker
+        """
+        self.db_session = db_session
+        self.get_qualification_set = get_qualification_set
+        self.mode = mode
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, question_id, rule_version):
+        """
+        Schedule the re-scoring of a question as part of the current transaction.
+
+        Unfinished jobs for the same question are superseded by the new one.
+
+        :param str question_id: id of the changed question
+        :param int rule_version: version of the question set the new answer belongs to
+        :return: the new job
+        :rtype: jorm.RescoreJob
+        """
+        now = datetime.datetime.utcnow()
+
+        self.db_session.query(jorm.RescoreJob)\
+            .filter(jorm.RescoreJob.question_id == question_id,
+                    jorm.RescoreJob.status.in_([jorm.RescoreJob.PENDING, jorm.RescoreJob.RUNNING]))\
+            .update({jorm.RescoreJob.status: jorm.RescoreJob.SUPERSEDED, jorm.RescoreJob.updated_at: now},
+                    synchronize_session=False)
+
+        rescore_job = jorm.RescoreJob(question_id=question_id,
+                                      rule_version=rule_version,
+                                      status=jorm.RescoreJob.PENDING,
+                                      processed=0,
+                                      changed=0,
+                                      created_at=now,
+                                      updated_at=now)
+        self.db_session.add(rescore_job)
+        self.db_session.flush()
+
+        return rescore_job
+
+    def notify(self):
+        """
+        Wake the idle worker after a job was committed.
+        """
+        self._wakeup.set()
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        self._stopping.clear()
+        name = '{}-{}-rescoring'.format(socket.gethostname(), os.getpid())
+        self._thread = threading.Thread(target=self._run, args=(name,), name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread once it finishes its current chunk.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, worker_name):
+        while not self._stopping.is_set():
+            try:
+                rescore_job = self._claim(worker_name)
+                while rescore_job is not None and not self._stopping.is_set():
+                    rescore_job = self.process_chunk(rescore_job, worker_name)
+                    self._stopping.wait(self.chunk_pause)
+            except Exception:
+                # Whatever went wrong, the worker keeps looking for jobs; the claimed job is resumed once
+                # its lease expires
+                logging.exception("Rescoring worker {} failed".format(worker_name))
+                self.db_session.rollback()
+                rescore_job = None
+            finally:
+                self.db_session.remove()
+
+            if rescore_job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self, worker_name):
+        """
+        Claim the oldest pending job, or a running job whose lease expired.
+
+        :param str worker_name: unique name of the claiming worker
+        :return: the claimed job, or None
+        :rtype: jorm.RescoreJob
+        """
+        now = datetime.datetime.utcnow()
+        lease_expiry = now - datetime.timedelta(seconds=self.lease_seconds)
+        claimable = (jorm.RescoreJob.status == jorm.RescoreJob.PENDING) | \
+                    ((jorm.RescoreJob.status == jorm.RescoreJob.RUNNING) &
+                     (jorm.RescoreJob.claimed_at < lease_expiry))
+
+        job_id = self.db_session.query(jorm.RescoreJob.id).filter(claimable)\
+            .order_by(jorm.RescoreJob.id).limit(1).scalar()
+        if job_id is None:
+            self.db_session.rollback()
+            return None
+
+        claimed = self.db_session.query(jorm.RescoreJob)\
+            .filter(jorm.RescoreJob.id == job_id, claimable)\
+            .update({jorm.RescoreJob.status: jorm.RescoreJob.RUNNING,
+                     jorm.RescoreJob.worker: worker_name,
+                     jorm.RescoreJob.claimed_at: now},
+                    synchronize_session=False)
+        self.db_session.commit()
+
+        if not claimed:
+            return None
+
+        rescore_job = self.db_session.query(jorm.RescoreJob).filter(jorm.RescoreJob.id == job_id).one()
+        if rescore_job.total is None:
+            rescore_job.total = self.db_session.query(func.count(jorm.ApplicantResponse.id))\
+                .filter(jorm.ApplicantResponse.question_id == rescore_job.question_id).scalar()
+            self.db_session.commit()
+
+        logging.info("Rescoring worker {} claimed job {} for question {}, {} of {} answers done".format(
+            worker_name, rescore_job.id, rescore_job.question_id, rescore_job.processed, rescore_job.total))
+
+        return rescore_job
+
+    def process_chunk(self, rescore_job, worker_name):
+        """
+        Re-score the next chunk of job applications of a job in a single transaction.
+
+        :param jorm.RescoreJob rescore_job: the claimed job
+        :param str worker_name: unique name of the worker
+        :return: the job if it has more chunks to process, otherwise None
+        :rtype: jorm.RescoreJob
+        """
+        self.db_session.refresh(rescore_job)
+        if rescore_job.status != jorm.RescoreJob.RUNNING or rescore_job.worker != worker_name:
+            logging.info("Rescoring job {} is {}, stopping".format(rescore_job.id, rescore_job.status))
+            self.db_session.rollback()
+            return None
+
+        qualification_set = self.get_qualification_set()
+        if rescore_job.question_id not in qualification_set:
+            return self._finish(rescore_job, jorm.RescoreJob.SUPERSEDED)
+        if qualification_set[rescore_job.question_id].version < rescore_job.rule_version:
+            # The compiled rules don't include the change yet, try again after the pause
+            self.db_session.rollback()
+            return rescore_job
+
+        # Walks the (question_id, job_application_id) index
+        changed_responses = self.db_session.query(jorm.ApplicantResponse)\
+            .filter(jorm.ApplicantResponse.question_id == rescore_job.question_id)
+        if rescore_job.cursor is not None:
+            changed_responses = changed_responses.filter(jorm.ApplicantResponse.job_application_id > rescore_job.cursor)
+        changed_responses = changed_responses.order_by(jorm.ApplicantResponse.job_application_id)\
+            .limit(self.chunk_size).all()
+
+        if not changed_responses:
+            return self._finish(rescore_job, jorm.RescoreJob.DONE)
+
+        job_application_ids = set(response.job_application_id for response in changed_responses)
+        responses_by_application = dict()
+        for response in self.db_session.query(jorm.ApplicantResponse)\
+                .filter(jorm.ApplicantResponse.job_application_id.in_(job_application_ids)):
+            responses_by_application.setdefault(response.job_application_id, list()).append(response)
+
+        # Re-score the changed question, and answers never scored because an earlier one failed
+        rescored_by_question = dict()
+        for responses in responses_by_application.values():
+            for response in responses:
+                if response.question_id == rescore_job.question_id or \
+                        (response.passed is None and response.question_id in qualification_set):
+                    rescored_by_question.setdefault(response.question_id, list()).append(response)
+
+        for question_id, responses in rescored_by_question.items():
+            scored_responses = jau.score_answers(qualification_set[question_id],
+                                                 [response.answer for response in responses],
+                                                 self.mode,
+                                                 self.cache)
+            for response, scored_response in zip(responses, scored_responses):
+                self._apply_score(response, scored_response)
+
+        changed = 0
+        now = datetime.datetime.utcnow()
+
+        for job_application in self.db_session.query(jorm.JobApplication)\
+                .filter(jorm.JobApplication.id.in_(job_application_ids)):
+            accepted = not any(response.passed is False for response in responses_by_application[job_application.id])
+            if accepted != job_application.accepted:
+                job_application.accepted = accepted
+                job_application.updated_at = now
+                changed += 1
+            job_application.rule_version = max(job_application.rule_version or 0, rescore_job.rule_version)
+
+        if changed:
+            jorm.bump_table_version(self.db_session, 'job_applications')
+
+        rescore_job.cursor = changed_responses[-1].job_application_id
+        rescore_job.processed += len(changed_responses)
+        rescore_job.changed += changed
+        rescore_job.claimed_at = now
+        rescore_job.updated_at = now
+        self.db_session.commit()
+
+        return rescore_job
+
+    def _apply_score(self, applicant_response, scored_response):
+        fuzzy_ratios = scored_response.get('fuzzy_ratios')
+
+        applicant_response.passed = scored_response['passed']
+        applicant_response.ratio = fuzzy_ratios.get('partial_token_set_ratio') if fuzzy_ratios else None
+        applicant_response.fuzzy_ratios = fuzzy_ratios
+        applicant_response.answer_in_response = scored_response.get('answer_in_response')
+
+    def _finish(self, rescore_job, status):
+        rescore_job.status = status
+        rescore_job.updated_at = datetime.datetime.utcnow()
+        self.db_session.commit()
+
+        logging.info("Rescoring job {} for question {} is {}: {} answers re-scored, {} job applications changed"
+                     .format(rescore_job.id, rescore_job.question_id, status, rescore_job.processed,
+                             rescore_job.changed))
+
+        return None
@@ -0,0 +1,224 @@
+"""
+jobber.api.jobber_search
+~~~~~~~~~~~~~~~~~~~~~~~~
+Full-text search over the names and answers of accepted job applications, using SQLite FTS5.
+
+"""
+
+import logging
+import re
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.exc import OperationalError
+import jobber_orm as jorm
+
+FTS_TABLE = 'job_applications_fts'
+# Matches in a name count twice as much as matches in the answers
+NAME_WEIGHT = 2.0
+ANSWERS_WEIGHT = 1.0
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query matching every word, the last one also as a prefix.
+
+    Quoting every word keeps FTS5 operators and punctuation in the text from being interpreted.
+    Only the last word, the one still being typed, is a prefix: a prefix matching many
+    words makes a query much slower.
+
+    :param str query: the text to search for
+    :return: str the FTS5 query, empty if the text has no words
+    """
+    words = ['"{}"'.format(word) for word in re.findall(r'\w+', query or '', re.UNICODE)]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+class SearchIndex(object):
+    """
+    FTS5 index of the accepted job applications.
+
+    The index is updated in the same transaction as the job applications: every flush of
+    an added, changed or deleted JobApplication re-indexes it. Job applications deleted
+    with a bulk query are re-indexed by calling update.
+    """
+
+    def __init__(self, db_session):
+        """
+        :param db_session: the scoped database session
+        """
+        self.db_session = db_session
+        self.available = False
+
+    def setup(self, batch_size=1000):
+        """
+        Create the index if it doesn't exist, index the existing job applications, and watch the session.
+
+        :param int batch_size: job applications indexed per transaction when building a new index
+        :return: bool whether full-text search is available, which needs SQLite with FTS5
+        """
+        bind = self.db_session.get_bind()
+        if bind.dialect.name != 'sqlite':
+            logging.info("Full-text search needs SQLite, it is disabled")
+            return False
+
+        with bind.begin() as connection:
+            exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                        name=FTS_TABLE).scalar()
+            if not exists:
+                try:
+                    # The prefix indexes serve the short prefixes of match_expression
+                    connection.execute(text("CREATE VIRTUAL TABLE {} USING fts5(name, answers, prefix='2 3', "
+                                            "tokenize='unicode61 remove_diacritics 2')".format(FTS_TABLE)))
+                except OperationalError:
+                    logging.info("Full-text search needs SQLite with FTS5, it is disabled")
+                    return False
+                connection.execute(text("INSERT INTO {0}({0}, rank) VALUES ('rank', 'bm25({1}, {2})')"
+                                        .format(FTS_TABLE, NAME_WEIGHT, ANSWERS_WEIGHT)))
+                connection.execute(jorm.SearchDocument.__table__.delete())
+
+        if not exists:
+            self.rebuild(batch_size)
+
+        self.available = True
+        event.listen(self.db_session, 'after_flush', self._after_flush)
+        return True
+
+    def _after_flush(self, session, flush_context):
+        # The pre-flush state and attribute history are still available after the flush
+        job_application_ids = set()
+        for job_application in session.new:
+            if isinstance(job_application, jorm.JobApplication):
+                job_application_ids.add(job_application.id)
+        for job_application in session.deleted:
+            if isinstance(job_application, jorm.JobApplication):
+                job_application_ids.add(job_application.id)
+        for job_application in session.dirty:
+            if isinstance(job_application, jorm.JobApplication) and self._indexed_changes(job_application):
+                job_application_ids.add(job_application.id)
+
+        if job_application_ids:
+            self._update(session.connection(), job_application_ids)
+
+    @staticmethod
+    def _indexed_changes(job_application):
+        # Re-scoring touches the rule version of every job application, only re-index changed verdicts and content
+        state = inspect(job_application)
+        return any(state.attrs[attribute].history.has_changes() for attribute in ('accepted', 'name', 'responses'))
+
+    def update(self, session, job_application_ids):
+        """
+        Bring the index up to date with job applications as part of the current transaction.
+
+        :param session: the database session
+        :param list job_application_ids: ids of job applications added, changed or deleted
+        """
+        if self.available and job_application_ids:
+            self._update(session.connection(), set(job_application_ids))
+
+    def _update(self, connection, job_application_ids):
+        job_application_ids = list(job_application_ids)
+        search_documents = jorm.SearchDocument.__table__
+        job_applications = jorm.JobApplication.__table__
+        applicant_responses = jorm.ApplicantResponse.__table__
+
+        indexed = dict((row.job_application_id, row.id) for row in connection.execute(
+            search_documents.select().where(search_documents.c.job_application_id.in_(job_application_ids))))
+        if indexed:
+            connection.execute(text("DELETE FROM {} WHERE rowid IN ({})".format(
+                FTS_TABLE, ', '.join(str(int(rowid)) for rowid in indexed.values()))))
+
+        names = dict((row.id, row.name) for row in connection.execute(
+            select([job_applications.c.id, job_applications.c.name])
+            .where(job_applications.c.accepted == True)  # noqa: E712
+            .where(job_applications.c.id.in_(job_application_ids))))
+
+        removed = [job_application_id for job_application_id in indexed if job_application_id not in names]
+        if removed:
+            connection.execute(search_documents.delete().where(search_documents.c.job_application_id.in_(removed)))
+        if not names:
+            return
+
+        answers = dict((job_application_id, list()) for job_application_id in names)
+        for job_application_id, answer in connection.execute(
+                select([applicant_responses.c.job_application_id, applicant_responses.c.answer])
+                .where(applicant_responses.c.job_application_id.in_(list(names)))
+                .order_by(applicant_responses.c.job_application_id, applicant_responses.c.position)):
+            if answer:
+                answers[job_application_id].append(answer)
+
+        added = [job_application_id for job_application_id in names if job_application_id not in indexed]
+        if added:
+            connection.execute(search_documents.insert(), [{'job_application_id': job_application_id}
+                                                           for job_application_id in added])
+            indexed.update((row.job_application_id, row.id) for row in connection.execute(
+                search_documents.select().where(search_documents.c.job_application_id.in_(added))))
+
+        connection.execute(text("INSERT INTO {}(rowid, name, answers) VALUES (:rowid, :name, :answers)"
+                                .format(FTS_TABLE)),
+                           [{'rowid': indexed[job_application_id],
+                             'name': name,
+                             'answers': '\n'.join(answers[job_application_id])}
+                            for job_application_id, name in names.items()])
+
+    def rebuild(self, batch_size=1000):
+        """
+        Index every accepted job application, in batches.
+
+        :param int batch_size: job applications indexed per transaction
+        :return: int number of job applications indexed
+        """
+        indexed = 0
+        cursor = None
+
+        while True:
+            job_application_ids = self.db_session.query(jorm.JobApplication.id)\
+                .filter(jorm.JobApplication.accepted == True)  # noqa: E712
+            if cursor is not None:
+                job_application_ids = job_application_ids.filter(jorm.JobApplication.id > cursor)
+            job_application_ids = [row.id for row in
+                                   job_application_ids.order_by(jorm.JobApplication.id).limit(batch_size)]
+
+            if not job_application_ids:
+                self.db_session.commit()
+                logging.info("Indexed {} job applications for full-text search".format(indexed))
+                return indexed
+
+            self._update(self.db_session.connection(), job_application_ids)
+            self.db_session.commit()
+            indexed += len(job_application_ids)
+            cursor = job_application_ids[-1]
+
+    def search(self, query, limit=20, offset=0, job_posting_id=None):
+        """
+        Find the accepted job applications whose name or answers contain every word of a query.
+
+        :param str query: the text to search for
+        :param int limit: maximum number of job applications to return
+        :param int offset: number of better ranked job applications to skip
+        :param str job_posting_id: only include job applications for this job posting
+        :return: list of dicts of the summary columns, the score and a snippet of every match, best first
+        """
+        columns = jorm.JobApplication.summary_columns
+        sql = "SELECT {}, -{fts}.rank AS score, snippet({fts}, -1, '[', ']', '...', 10) AS snippet " \
+              "FROM {fts} JOIN search_documents ON search_documents.id = {fts}.rowid " \
+              "JOIN job_applications ON job_applications.id = search_documents.job_application_id " \
+              "WHERE {fts} MATCH :match".format(', '.join('job_applications.{}'.format(column) for column in columns),
+                                                fts=FTS_TABLE)
+        parameters = {'match': match_expression(query), 'limit': limit, 'offset': offset}
+
+        if job_posting_id is not None:
+            sql += " AND job_applications.job_posting_id = :job_posting_id"
+            parameters['job_posting_id'] = job_posting_id
+        sql += " ORDER BY {}.rank LIMIT :limit OFFSET :offset".format(FTS_TABLE)
+
+        # Read through the ORM column types, so the timestamps come back as datetimes
+        statement = text(sql).columns(*[jorm.JobApplication.__table__.c[column] for column in columns])
+
+        results = list()
+        for row in self.db_session.execute(statement, parameters):
+            result = dict((column, row[column]) for column in columns)
+            result['score'] = row['score']
+            result['snippet'] = row['snippet']
+            results.append(result)
+        return results
@@ -0,0 +1,291 @@
+"""
+jobber.api.jobber_server
+~~~~~~~~~~~~~~~~~~~~~~~~
+Tornado server hosting the Jobber API.
+
+"""
+
+import logging
+import time
+import tornado
+from collections import deque
+from tornado import escape, gen, httputil
+from tornado.concurrent import Future
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+from tornado.wsgi import WSGIContainer
+import jobber_api_utils as jau
+import jobber_metrics as jmet
+
+READ = 'read'
+WRITE = 'write'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def classify_request(request):
+    """
+    Get the class of a request for admission control.
+
+    :param request: the Tornado request
+    :return: str READ or WRITE
+    """
+    return READ if request.method in READ_METHODS else WRITE
+
+
+class AdmissionController(object):
+    """
+    Hands out the turns to run requests, one at a time, reads before writes.
+
+    Handling a request blocks the IOLoop, so the requests that arrive meanwhile wait
+    in a queue per request class. Requests that find their queue full, or that waited
+    too long for their turn, are turned away with 429 Too Many Requests instead of
+    adding to the latency of everyone else.
+    """
+    priorities = (READ, WRITE)
+
+    def __init__(self, max_queued=None, max_wait=None, retry_after=1):
+        """
+        :param dict max_queued: request classes and how many of their requests may wait, 0 for no limit
+        :param dict max_wait: request classes and the seconds their requests may wait, 0 for no limit
+        :param int retry_after: seconds rejected clients are asked to wait before retrying
+        """
+        self.max_queued = max_queued or dict()
+        self.max_wait = max_wait or dict()
+        self.retry_after = retry_after
+        self.queues = dict((request_class, deque()) for request_class in self.priorities)
+        self.busy = False
+
+    def admit(self, request_class):
+        """
+        Wait for the turn of a request.
+
+        :param str request_class: READ or WRITE
+        :return: Future resolving to True once the request may run, or False if it is turned away
+        """
+        future = Future()
+
+        if not self.busy:
+            self.busy = True
+            jmet.admission_queue_wait.observe(0.0, request_class)
+            future.set_result(True)
+            return future
+
+        max_queued = self.max_queued.get(request_class, 0)
+        if max_queued and len(self.queues[request_class]) >= max_queued:
+            jmet.admission_rejected.inc(request_class, 'queue_full')
+            future.set_result(False)
+            return future
+
+        self.queues[request_class].append((future, time.perf_counter()))
+        return future
+
+    def release(self):
+        """
+        End the turn of the running request.
+
+        The next turn is handed out on the next IOLoop iteration, after the requests that
+        arrived meanwhile were read and queued, so a waiting read always goes first.
+        """
+        IOLoop.current().add_callback(self._next_turn)
+
+    def _next_turn(self):
+        now = time.perf_counter()
+
+        for request_class in self.priorities:
+            queue = self.queues[request_class]
+            max_wait = self.max_wait.get(request_class, 0)
+
+            while queue:
+                future, queued_at = queue.popleft()
+                waited = now - queued_at
+                jmet.admission_queue_wait.observe(waited, request_class)
+
+                if max_wait and waited > max_wait:
+                    jmet.admission_rejected.inc(request_class, 'timeout')
+                    future.set_result(False)
+                else:
+                    future.set_result(True)
+                    return
+
+        self.busy = False
+
+    def depths(self):
+        """
+        :return: dict of (request class,) tuples and the number of their requests waiting
+        """
+        return dict(((request_class,), len(queue)) for request_class, queue in self.queues.items())
+
+
+class _Turn(object):
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.admission.release()
+
+
+class StreamingWSGIContainer(WSGIContainer):
+    """
+    WSGIContainer that streams responses without a Content-Length in chunks.
+
+    Tornado's WSGIContainer joins the whole response body before writing it. Responses
+    that set a Content-Length are still written that way; streamed ones, such as
+    exports, are written chunk by chunk with a chunked transfer encoding, waiting for
+    each chunk to be flushed before generating the next, so memory stays constant.
+
+    With an AdmissionController, requests wait for their turn before they are handled.
+    """
+
+    def __init__(self, wsgi_application, admission=None):
+        super(StreamingWSGIContainer, self).__init__(wsgi_application)
+        self.admission = admission
+
+    @gen.coroutine
+    def __call__(self, request):
+        if self.admission is None:
+            yield self._respond(request, lambda: None)
+            return
+
+        admitted = yield self.admission.admit(classify_request(request))
+        if not admitted:
+            self._reject(request)
+            return
+
+        turn = _Turn(self.admission)
+        try:
+            yield self._respond(request, turn.release)
+        finally:
+            turn.release()
+
+    @gen.coroutine
+    def _respond(self, request, handled):
+        """
+        Run the WSGI application and write its response.
+
+        :param request: the Tornado request
+        :param handled: function called once the response is generated, before a streamed body is
+        """
+        data = {}
+        response = []
+
+        def start_response(status, response_headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = response_headers
+            return response.append
+
+        app_response = self.wsgi_application(WSGIContainer.environ(request), start_response)
+        try:
+            chunks = iter(app_response)
+            if not data:
+                # Some WSGI applications only call start_response once iterated
+                first_chunk = next(chunks, None)
+                if first_chunk is not None:
+                    response.append(first_chunk)
+            if not data:
+                raise Exception("WSGI app did not call start_response")
+
+            status_code, reason = data["status"].split(' ', 1)
+            status_code = int(status_code)
+            headers = data["headers"]
+            header_set = set(k.lower() for (k, v) in headers)
+            streaming = "content-length" not in header_set and status_code not in (204, 304) and \
+                request.version == "HTTP/1.1"
+
+            if "server" not in header_set:
+                headers.append(("Server", "TornadoServer/%s" % tornado.version))
+
+            start_line = httputil.ResponseStartLine("HTTP/1.1", status_code, reason)
+            header_obj = httputil.HTTPHeaders()
+            for key, value in headers:
+                header_obj.add(key, value)
+
+            if streaming:
+                # Other requests take turns with the chunks of a streamed body
+                handled()
+                # Without a Content-Length the connection uses a chunked transfer encoding
+                request.connection.write_headers(start_line, header_obj)
+                for chunk in response:
+                    yield request.connection.write(escape.utf8(chunk))
+                for chunk in chunks:
+                    if chunk:
+                        yield request.connection.write(escape.utf8(chunk))
+            else:
+                response.extend(chunks)
+                handled()
+                body = escape.utf8(b"".join(response))
+                if status_code != 304:
+                    if "content-length" not in header_set:
+                        header_obj.add("Content-Length", str(len(body)))
+                    if "content-type" not in header_set:
+                        header_obj.add("Content-Type", "text/html; charset=UTF-8")
+                request.connection.write_headers(start_line, header_obj, chunk=body)
+
+            request.connection.finish()
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+
+        self._log(status_code, request)
+
+    def _reject(self, request):
+        """
+        Answer a request that was turned away with 429 Too Many Requests.
+
+        :param request: the Tornado request
+        """
+        body = jau.dumps_json(jau.create_return_object(error_status=True,
+                                                       error_cause="Too many requests are waiting, retry later",
+                                                       error_message="Too Many Requests"))
+        header_obj = httputil.HTTPHeaders()
+        header_obj.add("Content-Type", "application/json")
+        header_obj.add("Content-Length", str(len(body)))
+        header_obj.add("Retry-After", str(self.admission.retry_after))
+        header_obj.add("Server", "TornadoServer/%s" % tornado.version)
+
+        start_line = httputil.ResponseStartLine("HTTP/1.1", 429, "Too Many Requests")
+        request.connection.write_headers(start_line, header_obj, chunk=body)
+        request.connection.finish()
+
+        self._log(429, request)
+
+
+def run(application, port, workers=1, before_fork=None, after_fork=None, admission=None):
+    """
+    Serve a WSGI application until the process is stopped.
+
+    With more than one worker the port is bound first, then the process forks into
+    workers that share the listening socket. The parent process only watches the
+    workers and restarts those that die.
+
+    :param application: the WSGI application
+    :param int port: port to listen on
+    :param int workers: number of worker processes, 0 for one per CPU
+    :param before_fork: function called in the parent before forking, e.g. to close its database connections
+    :param after_fork: function called in every worker once forked, e.g. to start its background threads
+    :param AdmissionController admission: admission control of the requests, None to handle every request
+    """
+    if workers == 1:
+        http_server = HTTPServer(StreamingWSGIContainer(application, admission))
+        http_server.listen(port)
+        logging.info("Listening on port {}".format(port))
+    else:
+        sockets = bind_sockets(port)
+        if before_fork is not None:
+            before_fork()
+
+        # Only returns in the workers
+        task_id = fork_processes(workers)
+
+        if after_fork is not None:
+            after_fork()
+        http_server = HTTPServer(StreamingWSGIContainer(application, admission))
+        http_server.add_sockets(sockets)
+        logging.info("Worker {} listening on port {}".format(task_id, port))
+
+    IOLoop.current().start()
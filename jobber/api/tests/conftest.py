@@ -0,0 +1,28 @@
+import os
+import sys
+import pytest
+
+# The API modules import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmpdir):
+    """
+    A Jobber app on a fresh database.
+    """
+    import jobber
+
+    app = jobber.create_app({'DB_DIR': str(tmpdir), 'DB_FILE_NAME': 'jobber.db', 'BATCH_WORKERS': 1})
+    yield app
+    app.app.extensions['jobber'].close()
+
+
+@pytest.fixture
+def state(app):
+    return app.app.extensions['jobber']
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
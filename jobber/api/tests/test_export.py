@@ -0,0 +1,56 @@
+"""
+jobber.api.tests.test_export
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Incremental exports of the job applications.
+
+"""
+
+import datetime
+import json
+import time
+import pytest
+import jobber
+import jobber_api_utils as jau
+import jobber_orm as jorm
+
+
+@pytest.fixture
+def app(tmpdir):
+    app = jobber.create_app({'DB_DIR': str(tmpdir), 'DB_FILE_NAME': 'jobber.db', 'EXPORT_WATERMARK_LAG': 1})
+    yield app
+    app.app.extensions['jobber'].close()
+
+
+def _export(client, updated_since=None):
+    path = '/1.0/job-applications:export?include_rejected=true'
+    if updated_since is not None:
+        path += '&updated_since={}'.format(updated_since)
+    response = client.get(path)
+    assert response.status_code == 200
+    ids = [json.loads(line)['id'] for line in response.data.decode('utf-8').splitlines()]
+    return ids, response.headers['X-Export-Watermark']
+
+
+def _save_job_application(db_session, job_application_id, updated_at):
+    db_session.add(jorm.JobApplication(id=job_application_id, name='Applicant', applicant_responses=[],
+                                       accepted=True, created_at=updated_at, updated_at=updated_at))
+    db_session.commit()
+
+
+def test_a_write_committed_after_an_export_is_in_a_later_one(client, state):
+    _save_job_application(state.db_session, 'old', datetime.datetime.utcnow() - datetime.timedelta(minutes=5))
+
+    stamped_at = datetime.datetime.utcnow()
+    ids, watermark = _export(client)
+    assert ids == ['old']
+    assert jau.parse_datetime(watermark) <= datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+
+    # Stamped before the export, committed after it, as when the write waited for the lock
+    _save_job_application(state.db_session, 'late', stamped_at)
+
+    ids, _ = _export(client, watermark)
+    assert ids == []
+
+    time.sleep(1.1)
+    ids, _ = _export(client, watermark)
+    assert ids == ['late']
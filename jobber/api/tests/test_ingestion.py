@@ -0,0 +1,68 @@
+"""
+jobber.api.tests.test_ingestion
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The ingestion queue workers.
+
+"""
+
+import pytest
+import jobber
+import jobber_ingestion as jing
+import jobber_orm as jorm
+
+
+@pytest.fixture
+def app(tmpdir):
+    # No worker threads, the tests drain the queue themselves
+    app = jobber.create_app({'DB_DIR': str(tmpdir), 'DB_FILE_NAME': 'jobber.db', 'DEDUP_WINDOW_SECONDS': 0,
+                             'ASYNC_INGESTION': 'true', 'INGESTION_WORKERS': 0})
+    yield app
+    app.app.extensions['jobber'].close()
+
+
+def _job_application(job_application_id, answer='the holy grail'):
+    return {'id': job_application_id, 'name': 'Applicant', 'applicant_responses': [{'id': 'q1', 'answer': answer}]}
+
+
+def _enqueue(queue, db_session, job_applications):
+    db_session.add(jorm.Question(id='q1', question='What is your quest?', answer='holy grail'))
+    for job_application in job_applications:
+        queue.enqueue(job_application)
+    db_session.commit()
+
+
+def _status(queue, job_application_id):
+    # Saved job applications leave the queue
+    item = queue.find(job_application_id)
+    return (item.status, item.error) if item is not None else 'saved'
+
+
+def test_malformed_items_fail_without_stopping_the_batch(state):
+    queue = state.ingestion_queue
+    odd = {'id': 'odd', 'name': 'Applicant', 'applicant_responses': ['the holy grail']}
+    _enqueue(queue, state.db_session, [_job_application('good'), _job_application('bad', answer=5), odd])
+
+    assert queue.process_batch('test') == 3
+
+    assert _status(queue, 'good') == 'saved'
+    assert _status(queue, 'bad') == (jorm.IngestionQueueItem.FAILED,
+                                     'applicant_responses[0].answer must be a string of 1 to 255 characters')
+    assert _status(queue, 'odd') == (jorm.IngestionQueueItem.FAILED, 'applicant_responses[0] must be an object')
+
+
+def test_items_that_fail_to_score_are_failed_one_by_one(state):
+    def score_batch(job_applications):
+        if any(job_application['id'] == 'explodes' for job_application in job_applications):
+            raise RuntimeError('scoring failed')
+        return state.score_queued_applications(job_applications)
+
+    queue = jing.IngestionQueue(state.db_session, score_batch, workers=0)
+    _enqueue(queue, state.db_session, [_job_application('first'), _job_application('explodes'),
+                                       _job_application('last')])
+
+    assert queue.process_batch('test') == 3
+
+    assert _status(queue, 'first') == 'saved'
+    assert _status(queue, 'last') == 'saved'
+    assert _status(queue, 'explodes') == (jorm.IngestionQueueItem.FAILED,
+                                          "Could not be scored: RuntimeError: scoring failed")
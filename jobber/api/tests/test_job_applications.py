@@ -0,0 +1,135 @@
+"""
+jobber.api.tests.test_job_applications
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The job application endpoints.
+
+"""
+
+import json
+import threading
+from sqlalchemy import event
+import jobber
+
+
+def _put(client, path, body):
+    response = client.put(path, data=json.dumps(body), content_type='application/json')
+    assert response.status_code in (200, 201), response.data
+    return json.loads(response.data.decode('utf-8'))
+
+
+def _create_job_application(client, job_application_id, question_count):
+    applicant_responses = list()
+    for position in range(question_count):
+        question_id = 'q{}'.format(position)
+        _put(client, '/1.0/questions/{}'.format(question_id),
+             {'id': question_id, 'question': 'Question {}?'.format(position), 'answer': 'any'})
+        applicant_responses.append({'id': question_id, 'answer': 'Answer {}'.format(position)})
+
+    _put(client, '/1.0/job-applications/{}'.format(job_application_id),
+         {'name': 'Applicant', 'applicant_responses': applicant_responses})
+
+
+class _StatementCounter(object):
+    """
+    Counts the SQL statements the current thread executes, leaving out the background workers'.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread_id = threading.get_ident()
+        self.count = 0
+
+    def _count(self, *args):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def _statements_to_get(client, state, job_application_id):
+    with _StatementCounter(state.db_session.get_bind()) as counter:
+        response = client.get('/1.0/job-applications/{}'.format(job_application_id))
+    assert response.status_code == 200
+    return counter.count, json.loads(response.data.decode('utf-8'))['data']
+
+
+def test_get_job_application_runs_the_same_statements_for_any_question_count(client, state):
+    _create_job_application(client, 'one', 1)
+    _create_job_application(client, 'forty', 40)
+
+    one_count, one = _statements_to_get(client, state, 'one')
+    forty_count, forty = _statements_to_get(client, state, 'forty')
+
+    assert len(one['applicant_responses']) == 1
+    assert len(forty['applicant_responses']) == 40
+    assert one_count > 0
+    assert forty_count == one_count
+
+
+def test_get_job_application_with_a_deleted_question(client):
+    _create_job_application(client, 'ja1', 2)
+    assert client.delete('/1.0/questions/q1').status_code == 200
+
+    response = client.get('/1.0/job-applications/ja1')
+    assert response.status_code == 200
+
+    applicant_responses = json.loads(response.data.decode('utf-8'))['data']['applicant_responses']
+    assert [(ar['id'], ar['question'], ar['question_deleted']) for ar in applicant_responses] == \
+        [('q0', 'Question 0?', False), ('q1', None, True)]
+
+
+def _post_batch(client, job_applications):
+    response = client.post('/1.0/job-applications:batch', data=json.dumps(job_applications),
+                           content_type='application/json')
+    assert response.status_code == 200
+    return json.loads(response.data.decode('utf-8'))['data']['results']
+
+
+def test_a_retried_batch_reports_the_first_verdicts(client):
+    _put(client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'holy grail'})
+    batch = [{'id': 'a1', 'name': 'Arthur', 'applicant_responses': [{'id': 'q1', 'answer': 'the holy grail'}]},
+             {'id': 'r1', 'name': 'Robin', 'applicant_responses': [{'id': 'q1', 'answer': 'run away'}]},
+             {'id': 'a2', 'name': 'ARTHUR', 'applicant_responses': [{'id': 'q1', 'answer': 'the  holy grail'}]}]
+
+    first = _post_batch(client, batch)
+    assert [(result['status'], result.get('duplicate_of')) for result in first] == \
+        [('accepted', None), ('rejected', None), ('accepted', 'a1')]
+
+    for job_application in batch:
+        job_application['id'] += '-retry'
+    retried = _post_batch(client, batch)
+    assert [(result['id'], result['status'], result['code'], result['duplicate_of']) for result in retried] == \
+        [('a1-retry', 'accepted', 200, 'a1'), ('r1-retry', 'rejected', 200, 'r1'), ('a2-retry', 'accepted', 200, 'a1')]
+
+    response = client.get('/1.0/job-applications/a1-retry')
+    assert response.status_code == 404
+
+
+def test_batch_items_need_an_id_the_job_application_path_accepts(client):
+    batch = [{'id': 'ja/1', 'name': 'Arthur', 'applicant_responses': []},
+             {'id': 'ja-1', 'name': 'Arthur', 'applicant_responses': []}]
+
+    results = _post_batch(client, batch)
+    assert [(result['id'], result['code'], result.get('message')) for result in results] == \
+        [('ja/1', 400, 'id must only contain letters, digits and hyphens'), ('ja-1', 201, None)]
+    assert client.get('/1.0/job-applications/ja-1').status_code == 200
+
+
+def test_apps_do_not_share_state(app, client, tmpdir):
+    other = jobber.create_app({'DB_DIR': str(tmpdir.mkdir('other')), 'DB_FILE_NAME': 'jobber.db', 'BATCH_WORKERS': 1})
+    other_client = other.app.test_client()
+    job_application = {'name': 'Arthur', 'applicant_responses': [{'id': 'q1', 'answer': 'the holy grail'}]}
+
+    _put(client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'holy grail'})
+    _put(other_client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'run away'})
+    assert _put(client, '/1.0/job-applications/ja1', job_application)['data']['accepted'] is True
+    assert _put(other_client, '/1.0/job-applications/ja1', job_application)['data']['accepted'] is False
+
+    other.app.extensions['jobber'].close()
+    assert app.app.extensions['jobber'] is not other.app.extensions['jobber']
+    assert client.get('/1.0/job-applications/ja1').status_code == 200
@@ -0,0 +1,25 @@
+"""
+jobber.api.tests.test_job_postings
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The job posting endpoints.
+
+"""
+
+import json
+import jobber_orm as jorm
+
+
+def _put(client, path, body):
+    response = client.put(path, data=json.dumps(body), content_type='application/json')
+    assert response.status_code in (200, 201), response.data
+
+
+def test_deleting_a_job_posting_deletes_its_questions(client, state):
+    _put(client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'holy grail'})
+    _put(client, '/1.0/job-postings/knight', {'title': 'Knight', 'question_ids': ['q1']})
+    _put(client, '/1.0/job-postings/squire', {'title': 'Squire', 'question_ids': ['q1']})
+
+    assert client.delete('/1.0/job-postings/knight').status_code == 200
+
+    links = state.db_session.query(jorm.JobPostingQuestion.job_posting_id, jorm.JobPostingQuestion.question_id).all()
+    assert links == [('squire', 'q1')]
@@ -0,0 +1,24 @@
+"""
+jobber.api.tests.test_metrics
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The in-process metrics.
+
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+import jobber_metrics as jmet
+
+
+def test_failed_statements_leave_no_start_times_behind():
+    engine = create_engine('sqlite://')
+    jmet.instrument_engine(engine)
+
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute('SELECT * FROM missing')
+        assert connection.execute('SELECT 1').scalar() == 1
+
+        assert 'jobber_statement_started' not in connection.info
@@ -0,0 +1,55 @@
+"""
+jobber.api.tests.test_rescoring
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The background re-scoring of stored job applications.
+
+"""
+
+import json
+import time
+import jobber_orm as jorm
+import jobber_rescoring as jres
+
+
+def _put(client, path, body):
+    response = client.put(path, data=json.dumps(body), content_type='application/json')
+    assert response.status_code in (200, 201), response.data
+
+
+def _rescore_jobs(client):
+    response = client.get('/1.0/rescore-jobs')
+    assert response.status_code == 200
+    return json.loads(response.data.decode('utf-8'))['data']['rescore_jobs']
+
+
+def test_the_worker_survives_a_failed_chunk(client, state):
+    # Only the rescorer under test works on the job
+    state.rescorer.stop()
+
+    _put(client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'holy grail'})
+    _put(client, '/1.0/job-applications/ja1',
+         {'name': 'Arthur', 'applicant_responses': [{'id': 'q1', 'answer': 'the holy grail'}]})
+    _put(client, '/1.0/questions/q1', {'id': 'q1', 'question': 'What is your quest?', 'answer': 'run away'})
+
+    calls = list()
+
+    def get_qualification_set():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError('rules unavailable')
+        return state.get_qualification_set()
+
+    rescorer = jres.Rescorer(state.db_session, get_qualification_set, chunk_pause=0, poll_interval=0.01,
+                             lease_seconds=0)
+    rescorer.start()
+    try:
+        deadline = time.time() + 10
+        while _rescore_jobs(client)[0]['status'] != 'done' and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        rescorer.stop()
+
+    assert len(calls) > 1
+    assert _rescore_jobs(client)[0]['status'] == 'done'
+    assert state.db_session.query(jorm.JobApplication.accepted).filter(jorm.JobApplication.id == 'ja1').scalar() \
+        is False
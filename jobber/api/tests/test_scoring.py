@@ -0,0 +1,117 @@
+"""
+jobber.api.tests.test_scoring
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+The full and decision scoring modes reach the same decisions.
+
+"""
+
+import random
+import pytest
+import jobber_api_utils as jau
+
+WORDS = ['holy', 'grail', 'quest', 'swallow', 'coconut', 'shrubbery', 'Ni!', 'African', 'european', 'blue']
+
+
+def _random_answer(rng, acceptable_answer):
+    # Mix exact, partial, reordered, re-cased and unrelated answers
+    words = acceptable_answer.split(' ')
+    kind = rng.randrange(5)
+    if kind == 0:
+        return acceptable_answer
+    if kind == 1:
+        return ' '.join(rng.sample(words, len(words))).upper()
+    if kind == 2:
+        return 'I seek the {}'.format(' '.join(words[:rng.randint(1, len(words))]))
+    if kind == 3:
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    return ''.join(rng.choice('abcdefgh ') for _ in range(rng.randint(1, 12)))
+
+
+def _random_questions(rng, count):
+    questions = dict()
+    for position in range(count):
+        if rng.random() < 0.2:
+            questions['q{}'.format(position)] = rng.choice(['any', 'Any', 'ANY'])
+        else:
+            questions['q{}'.format(position)] = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+    return questions
+
+
+def _random_job_application(rng, questions):
+    return {
+        'id': 'ja{}'.format(rng.randrange(10 ** 6)),
+        'name': 'Applicant',
+        'applicant_responses': [{'id': question_id, 'answer': _random_answer(rng, answer)}
+                                for question_id, answer in questions.items()]
+    }
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('cached', [False, True])
+def test_modes_reach_identical_decisions(seed, cached):
+    rng = random.Random(seed)
+    answers = _random_questions(rng, rng.randint(1, 8))
+    questions = jau.QualificationSet(answers, version=1)
+    cache = jau.VerdictCache(maxsize=1000) if cached else None
+
+    for _ in range(25):
+        job_application = _random_job_application(rng, answers)
+        full = jau.score_job_application(questions, job_application, mode=jau.FULL_SCORING, cache=cache)
+        decision = jau.score_job_application(questions, job_application, mode=jau.DECISION_SCORING, cache=cache)
+
+        assert decision['accepted'] == full['accepted']
+        for full_response, decision_response in zip(full['applicant_responses'], decision['applicant_responses']):
+            if 'passed' in decision_response:
+                assert decision_response['passed'] == full_response['passed']
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_decision_mode_stops_at_first_failing_answer(seed):
+    rng = random.Random(seed)
+    answers = _random_questions(rng, 8)
+    questions = jau.QualificationSet(answers, version=1)
+
+    for _ in range(25):
+        job_application = _random_job_application(rng, answers)
+        full = jau.score_job_application(questions, job_application, mode=jau.FULL_SCORING)
+        decision = jau.score_job_application(questions, job_application, mode=jau.DECISION_SCORING)
+
+        verdicts = [response['passed'] for response in full['applicant_responses']]
+        scored = [response for response in decision['applicant_responses'] if 'passed' in response]
+
+        if all(verdicts):
+            assert len(scored) == len(verdicts)
+        else:
+            first_failing = verdicts.index(False)
+            assert len(scored) == first_failing + 1
+            assert scored[-1]['passed'] is False
+            assert all('fuzzy_ratios' not in response
+                       for response in decision['applicant_responses'][first_failing + 1:])
+
+
+def test_any_accepts_every_answer_without_matching():
+    questions = jau.QualificationSet({'q1': 'any', 'q2': 'ANY'})
+    job_application = {'id': 'ja1', 'name': 'Applicant',
+                       'applicant_responses': [{'id': 'q1', 'answer': 'whatever'}, {'id': 'q2', 'answer': 'x'}]}
+
+    full = jau.score_job_application(questions, job_application, mode=jau.FULL_SCORING)
+    decision = jau.score_job_application(questions, job_application, mode=jau.DECISION_SCORING)
+
+    assert full['accepted'] is True
+    assert decision['accepted'] is True
+    assert all('fuzzy_ratios' not in response for response in decision['applicant_responses'])
+
+
+def test_explain_adds_the_full_breakdown_to_a_decision():
+    questions = jau.QualificationSet({'q1': 'holy grail', 'q2': 'swallow'})
+    job_application = {'id': 'ja1', 'name': 'Applicant',
+                       'applicant_responses': [{'id': 'q1', 'answer': 'the Holy Grail'},
+                                               {'id': 'q2', 'answer': 'coconut'}]}
+
+    full = jau.score_job_application(questions, job_application, mode=jau.FULL_SCORING)
+    decision = jau.score_job_application(questions, job_application, mode=jau.DECISION_SCORING)
+    explained = jau.explain_job_application(questions, decision)
+
+    for full_response, explained_response in zip(full['applicant_responses'], explained['applicant_responses']):
+        assert explained_response['fuzzy_ratios'] == full_response['fuzzy_ratios']
+        assert explained_response['answer_in_response'] == full_response['answer_in_response']
@@ -0,0 +1,114 @@
+"""
+jobber.web.api_client
+~~~~~~~~~~~~~~~~~~~~~
+Pooled HTTP client the Jobber web app uses to call the Jobber API.
+
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class ApiClient(object):
+    """
+    Keep-alive HTTP client with a bounded connection pool, timeouts and retries.
+
+    JSON resources fetched with get_json are cached and revalidated with conditional requests.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=2.0, read_timeout=10.0, retries=3, backoff_factor=0.2,
+                 cache_size=128):
+        """
+        :param int pool_size: maximum number of pooled connections to the API
+        :param float connect_timeout: seconds to wait for a connection
+        :param float read_timeout: seconds to wait for a response
+        :param int retries: times to retry a failed idempotent request
+        :param float backoff_factor: base of the exponential backoff between retries, in seconds
+        :param int cache_size: maximum number of responses to cache, 0 disables the cache
+        """
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request over a pooled connection.
+
+        :param str method: HTTP method
+        :param str url: URL of the API resource
+        :return: the API response
+        :rtype: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        logging.debug("{} {} took {:.1f}ms".format(method, url, response.elapsed.total_seconds() * 1000))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def get_json(self, url, params=None):
+        """
+        Get a JSON resource, revalidating a cached copy with If-None-Match and If-Modified-Since.
+
+        :param str url: URL of the API resource
+        :param dict params: query parameters
+        :return: the decoded JSON document, a fresh copy on every call
+        """
+        if self.cache_size <= 0:
+            return self.get(url, params=params).json()
+
+        cache_key = requests.Request('GET', url, params=params).prepare().url
+
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+
+        headers = dict()
+        if cached is not None:
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.get(cache_key, headers=headers)
+
+        if response.status_code == 304 and cached is not None:
+            content = cached['content']
+        else:
+            content = response.content
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+            with self._cache_lock:
+                if response.status_code == 200 and (etag is not None or last_modified is not None):
+                    self._cache[cache_key] = {'etag': etag, 'last_modified': last_modified, 'content': content}
+                    self._cache.move_to_end(cache_key)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                else:
+                    self._cache.pop(cache_key, None)
+
+        # Decode on every call, callers are free to modify what they get back
+        return json.loads(content.decode('utf-8'))
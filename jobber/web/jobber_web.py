@@ -6,12 +6,13 @@ REST endpoints for the Jobber web app.
 """
 
 from datetime import datetime
-import requests
 from os import getenv
 import logging
-from flask import Flask, abort, flash, redirect, render_template, request, url_for
+import time
+from flask import Flask, abort, flash, g, redirect, render_template, request, url_for
 import traceback
 from momentjs import momentjs
+from api_client import ApiClient
 import uuid
 from collections import defaultdict
 
@@ -23,10 +24,34 @@ app.config['SECRET_KEY'] = 'some_really_long_random_string_here'
 app_port = int(getenv('APP_PORT', '5000'))
 questions_endpoint = getenv('QUESTIONS_ENDPOINT', 'http://localhost:8080/1.0/questions')
 application_endpoint = getenv('APPLICATION_ENDPOINT', 'http://localhost:8080/1.0/job-applications')
+applications_page_size = int(getenv('APPLICATIONS_PAGE_SIZE', '50'))
+
+api = ApiClient(pool_size=int(getenv('API_POOL_SIZE', '10')),
+                connect_timeout=float(getenv('API_CONNECT_TIMEOUT', '2')),
+                read_timeout=float(getenv('API_READ_TIMEOUT', '10')),
+                retries=int(getenv('API_RETRIES', '3')),
+                backoff_factor=float(getenv('API_RETRY_BACKOFF', '0.2')),
+                cache_size=int(getenv('API_CACHE_SIZE', '128')))
 
 nested_dict = lambda: defaultdict(nested_dict)
 
 
+@app.before_request
+def start_timer():
+    g.request_started = time.time()
+
+
+@app.after_request
+def record_latency(response):
+    """
+    Report how long the page took to build, API calls included.
+    """
+    elapsed_ms = (time.time() - g.request_started) * 1000
+    response.headers['Server-Timing'] = 'page;dur={:.1f}'.format(elapsed_ms)
+    logging.info("{} {} took {:.1f}ms".format(request.method, request.path, elapsed_ms))
+    return response
+
+
 @app.route('/')
 def show_home_page():
     """
@@ -38,12 +63,15 @@ def show_home_page():
 @app.route('/job-applications', methods = ['GET'])
 def show_job_applications():
     """
-    Show the list of accepted job applications.
+    Show a page of accepted job applications, newest first.
     """
     job_applications = list()
 
-    r = requests.get(application_endpoint)
-    response = r.json()
+    params = {'view': 'summary', 'limit': applications_page_size}
+    if request.args.get('cursor'):
+        params['cursor'] = request.args['cursor']
+
+    response = api.get_json(application_endpoint, params=params)
 
     for job_application in response['data']['job_applications']:
         # Datetime format: 2017-04-08 18:33:43.303353
@@ -51,9 +79,9 @@ def show_job_applications():
         job_application['updated_at'] = datetime.strptime(job_application['updated_at'], '%Y-%m-%dT%H:%M:%S.%fZ')
         job_applications.append(job_application)
 
-    sorted_applications = sorted(job_applications, key=lambda k: k['created_at'], reverse=True)
-
-    return render_template('job_applications/list.html', job_applications=sorted_applications)
+    return render_template('job_applications/list.html',
+                           job_applications=job_applications,
+                           next_cursor=response['data']['next_cursor'])
 
 
 @app.route('/job-applications/<job_application_id>', methods = ['GET'])
@@ -62,7 +90,7 @@ def show_job_application(job_application_id):
     Show a single job application.
     """
     url = "{}/{}".format(application_endpoint, job_application_id)
-    r = requests.get(url)
+    r = api.get(url)
     response = r.json()
 
     job_application = response['data']
@@ -79,8 +107,7 @@ def apply_for_job():
     """
     questions = list()
 
-    r = requests.get(questions_endpoint)
-    response = r.json()
+    response = api.get_json(questions_endpoint)
 
     for question in response['data']['questions']:
         del question['answer']
@@ -88,7 +115,8 @@ def apply_for_job():
         del question['updated_at']
         questions.append(question)
 
-    return render_template('/job_applications/new.html', questions=questions)
+    # Resubmitting the form, e.g. after a double click or a retry, sends the same key
+    return render_template('/job_applications/new.html', questions=questions, idempotency_key=str(uuid.uuid4()))
 
 
 @app.route('/save-job-application', methods = ['POST'])
@@ -107,11 +135,15 @@ def save_job_application():
     job_application['applicant_responses'] = list()
 
     for qid, answer in request.form.to_dict().items():
-        if qid != 'applicant_name':
+        if qid not in ('applicant_name', 'idempotency_key'):
             job_application['applicant_responses'].append({"answer": answer, "id": qid})
 
+    headers = dict()
+    if request.form.get('idempotency_key'):
+        headers['Idempotency-Key'] = request.form['idempotency_key']
+
     url = "{}/{}".format(application_endpoint, aid)
-    requests.put(url, json=job_application)
+    api.put(url, json=job_application, headers=headers)
 
     return redirect('job-applications')
 
@@ -133,12 +165,11 @@ def show_questions():
             "answer": request.form['answer']
         }
         url = "{}/{}".format(questions_endpoint, question_data['id'])
-        requests.put(url, json=question_data)
+        api.put(url, json=question_data)
 
     questions = list()
 
-    r = requests.get(questions_endpoint)
-    response = r.json()
+    response = api.get_json(questions_endpoint)
 
     for question in response['data']['questions']:
         question['created_at'] = datetime.strptime(question['created_at'], '%Y-%m-%dT%H:%M:%S.%fZ')
@@ -162,7 +193,7 @@ def update_question(question_id):
             "answer": request.form['answer']
         }
         url = "{}/{}".format(questions_endpoint, question_data['id'])
-        requests.put(url, json=question_data)
+        api.put(url, json=question_data)
     except:
         logging.error(traceback.format_exc())
 
@@ -175,8 +206,7 @@ def edit_question(question_id):
     Render the question edit page.
     """
     url = "{}/{}".format(questions_endpoint, question_id)
-    r = requests.get(url)
-    response = r.json()
+    response = api.get_json(url)
     return render_template('questions/edit.html', question=response['data'])
 
 